@@ -1,4 +1,5 @@
 import asyncio
+from typing import Callable, Optional
 from videosdk import (
     VideoSDK,
     Meeting,
@@ -9,6 +10,7 @@ from videosdk import (
 
 # types
 from videosdk import MeetingConfig, Stream
+from agent.subscription import ConsumerFilter, SubscriptionPolicy, SUBSCRIBE_DECODE
 from intelligence.intelligence import Intelligence
 from stt.stt import STT
 from videosdk.stream import MediaStreamTrack
@@ -21,6 +23,8 @@ class AIInterviewer:
         audio_track: MediaStreamTrack,
         stt: STT,
         intelligence: Intelligence,
+        subscriptions: Optional[SubscriptionPolicy] = None,
+        on_first_participant: Optional[Callable[[], None]] = None,
     ):
         self.name = "Interviewer"
         self.loop = loop
@@ -28,6 +32,11 @@ class AIInterviewer:
         self.stt: STT = stt
         self.intelligence: Intelligence = intelligence
         self.audio_track = audio_track
+        # what is done with each kind of remote stream, audio is decoded and video declined by default
+        self.subscriptions = subscriptions or SubscriptionPolicy()
+        self.consumer_filter = ConsumerFilter(loop=loop, policy=self.subscriptions)
+        # e.g. the opening line, called when the candidate joins
+        self.on_first_participant = on_first_participant
 
     async def join(self, meeting_id: str, token: str):
         meeting_config = MeetingConfig(
@@ -37,22 +46,39 @@ class AIInterviewer:
             webcam_enabled=False,
             custom_microphone_audio_track=self.audio_track,
             token=token,
+            loop=self.loop,
         )
         self.meeting = VideoSDK.init_meeting(**meeting_config)
 
-        self.meeting.add_event_listener(MyMeetingEventListener(stt=self.stt))
+        if self.subscriptions.filtered:
+            self.consumer_filter.attach(self.meeting)
+        self.meeting.add_event_listener(
+            MyMeetingEventListener(
+                stt=self.stt,
+                subscriptions=self.subscriptions,
+                on_first_participant=self.on_first_participant,
+            )
+        )
 
         await self.meeting.async_join()
 
     async def leave(self):
         print("leaving meeting...")
+        self.consumer_filter.close()
         self.meeting.leave()
 
 
 class MyMeetingEventListener(MeetingEventHandler):
-    def __init__(self, stt: STT):
+    def __init__(
+        self,
+        stt: STT,
+        subscriptions: Optional[SubscriptionPolicy] = None,
+        on_first_participant: Optional[Callable[[], None]] = None,
+    ):
         super().__init__()
         self.stt = stt
+        self.subscriptions = subscriptions or SubscriptionPolicy()
+        self.on_first_participant = on_first_participant
         print("Meeting :: EventListener initialized")
 
     def on_meeting_state_change(self, data):
@@ -66,8 +92,16 @@ class MyMeetingEventListener(MeetingEventHandler):
 
     def on_participant_joined(self, participant: Participant):
         print(f"Participant {participant.display_name} joined")
+        if self.on_first_participant is not None:
+            callback, self.on_first_participant = self.on_first_participant, None
+            try:
+                callback()
+            except Exception as e:
+                print("Error while greeting participant", e)
         participant.add_event_listener(
-            MyParticipantEventListener(stt=self.stt, participant=participant)
+            MyParticipantEventListener(
+                stt=self.stt, participant=participant, subscriptions=self.subscriptions
+            )
         )
 
     def on_participant_left(self, participant: Participant):
@@ -76,35 +110,26 @@ class MyMeetingEventListener(MeetingEventHandler):
 
 
 class MyParticipantEventListener(ParticipantEventHandler):
-    def __init__(self, stt: STT, participant: Participant):
+    def __init__(self, stt: STT, participant: Participant, subscriptions: SubscriptionPolicy):
         super().__init__()
         self.stt = stt
         self.participant = participant
-        self.dummy_tracks: dict[str, asyncio.Task] = {}
+        self.subscriptions = subscriptions
         print(f"Participant-{participant.display_name} :: EventListener initialized")
 
-    async def dummy(self, track):
-        try:
-            while True:
-                await track.recv()
-        except Exception as e:
-            print("error while consuming dummy stream", e)
-
     def on_stream_enabled(self, stream: Stream):
+        action = self.subscriptions.action(stream.kind)
         print(
-            f"Participant-{self.participant.display_name} :: {stream.kind} stream enabled"
+            f"Participant-{self.participant.display_name} :: {stream.kind} stream enabled ({action})"
         )
-        if stream.kind == "audio":
+        if stream.kind == "audio" and action == SUBSCRIBE_DECODE:
             self.stt.start(
                 peer_id=self.participant.id,
                 peer_name=self.participant.display_name,
                 stream=stream,
             )
-        else:
-            # create dummy stream to consume video/screenshare stream to reduce memory usage
-            self.dummy_tracks[stream.track.id] = asyncio.create_task(
-                self.dummy(track=stream.track)
-            )
+        # other tracks are not read: drained and declined ones never reach the decoder,
+        # decoded video frames stay in the track's bounded buffer, oldest dropped first
 
     def on_stream_disabled(self, stream: Stream):
         print(
@@ -112,7 +137,3 @@ class MyParticipantEventListener(ParticipantEventHandler):
         )
         if stream.kind == "audio":
             self.stt.stop(peer_id=self.participant.id)
-        else:
-            if stream.track.id in self.dummy_tracks:
-                self.dummy_tracks[stream.track.id].cancel()
-                del self.dummy_tracks[stream.track.id]
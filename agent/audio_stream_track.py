@@ -1,15 +1,26 @@
 import asyncio
+from contextlib import aclosing
 from fractions import Fraction
-import threading
-import time
 import traceback
-from typing import Iterator, Optional
+from typing import AsyncIterator, Callable, Iterator, List, Optional, Union
 from av import AudioFrame
 from vsaiortc.mediastreams import AudioStreamTrack
 import numpy as np
+from agent.media_clock import MediaClock
+from agent.ring_buffer import AudioRingBuffer
+from agent.tracing import TurnTracer
+from agent.tts_job import TTSJob
 
 
 AUDIO_PTIME = 0.02
+AUDIO_BUFFER_SECONDS = 5
+# a job stops reading its source while this much audio is buffered, leaves room for the
+# next phrase's tts request without letting a long reply download far ahead of playback
+AUDIO_HIGH_WATERMARK_SECONDS = 1.5
+# frames handed out by recv are reused round-robin, the sender is done with one long before it comes back
+AUDIO_FRAME_POOL_SIZE = 4
+# what is left of a filler clip is faded out over this long when the real reply starts
+FILLER_FADE_MS = 60
 
 
 def build_audio_frame(chunk: bytes) -> AudioFrame:
@@ -18,6 +29,27 @@ def build_audio_frame(chunk: bytes) -> AudioFrame:
     audio_frame = AudioFrame.from_ndarray(data.T, format="s16", layout="mono")
     return audio_frame
 
+def build_silence_frame(samples: int, sample_rate: int) -> AudioFrame:
+    frame = AudioFrame(format="s16", layout="mono", samples=samples)
+    for p in frame.planes:
+        p.update(bytes(p.buffer_size))
+    frame.sample_rate = sample_rate
+    return frame
+
+
+class AudioFramePool:
+    def __init__(self, size: int, samples: int, sample_rate: int):
+        self.frames = [build_silence_frame(samples, sample_rate) for _ in range(size)]
+        self.index = 0
+
+    def acquire(self, chunk: bytes) -> AudioFrame:
+        # refill the oldest frame in place instead of allocating a new one
+        frame = self.frames[self.index]
+        self.index = (self.index + 1) % len(self.frames)
+        frame.planes[0].update(chunk)
+        return frame
+
+
 class MediaStreamError(Exception):
     pass
 
@@ -25,17 +57,11 @@ class MediaStreamError(Exception):
 class CustomAudioStreamTrack(AudioStreamTrack):
     def __init__(
         self, loop, handle_interruption: Optional[bool] = True,
+        tracer: Optional[TurnTracer] = None,
+        clock: Optional[MediaClock] = None,
     ):
         super().__init__()
         self.loop = loop
-        self._start = None
-        self._timestamp = 0
-
-        # frame buffer to send frames in videosdk meeting
-        self.frame_buffer = []
-
-        # Audio data buffer to store incoming audio
-        self.audio_data_buffer = bytearray()
 
         # Audio frame properties
         self.frame_time = 0
@@ -46,73 +72,236 @@ class CustomAudioStreamTrack(AudioStreamTrack):
         self.samples = int(AUDIO_PTIME * self.sample_rate)
         self.chunk_size = int(self.samples * self.channels * self.sample_width)
 
-        self._process_audio_task_queue = asyncio.Queue()
-        self._process_audio_thread = threading.Thread(target=self.process_incoming_audio)
-        self._process_audio_thread.daemon = True
-        self._process_audio_thread.start()
+        # pcm ring buffer filled by the audio task and drained chunk by chunk in recv
+        buffer_chunks = int(AUDIO_BUFFER_SECONDS / AUDIO_PTIME)
+        self.ring_buffer = AudioRingBuffer(capacity=buffer_chunks * self.chunk_size)
+        self.high_watermark = int(AUDIO_HIGH_WATERMARK_SECONDS / AUDIO_PTIME) * self.chunk_size
+
+        # preallocated frames, recv only stamps pts and time_base on them
+        self.frame_pool = AudioFramePool(
+            size=AUDIO_FRAME_POOL_SIZE, samples=self.samples, sample_rate=self.sample_rate
+        )
+        self.silence_frame = build_silence_frame(self.samples, self.sample_rate)
+
+        # frames are paced on a monotonic clock, shared with the other tracks of the process if given
+        self.clock = clock or MediaClock(loop=loop, ptime=AUDIO_PTIME)
+        self.pacer = self.clock.pacer()
+
+        self._process_audio_task_queue: "asyncio.Queue[TTSJob]" = asyncio.Queue()
+        self._space_available = asyncio.Event()
+        self._producing = False
+        # job being written to the ring buffer, cancelled on interrupt
+        self.current_job: Optional[TTSJob] = None
+
+        # speaking state is driven by recv draining the ring buffer
+        self.is_speaking = False
+        self.not_speaking = asyncio.Event()
+        self.not_speaking.set()
+        self._speaking_listeners: List[Callable[[bool], None]] = []
+
+        self._process_audio_task = self.loop.create_task(self.process_incoming_audio())
 
         self.handle_interruption = handle_interruption
-        self.skip_next_chunk = False
-
-    def interrupt(self):
-        if self.handle_interruption == True:
-          length = len(self.frame_buffer)
-          self.frame_buffer.clear()
-          while not self._process_audio_task_queue.empty():
-              self.skip_next_chunk = True
-              self._process_audio_task_queue.get_nowait()
-              self._process_audio_task_queue.task_done()
-              
-          if length>0:
-              self.skip_next_chunk = True
-
-    def add_new_bytes(self, bytes: Iterator[bytes]):
-        self.interrupt()
-        self._process_audio_task_queue.put_nowait(bytes)
-
-    def process_incoming_audio(self):
-        while True:
+
+        # first frame of a reply is marked on the turn tracer when recv hands it out
+        self.tracer = tracer
+        self._first_frame_job: Optional[TTSJob] = None
+
+        # filler clip currently in the ring buffer, see play_filler
+        self._filler_active = False
+        self.filler_fade_bytes = (
+            int(FILLER_FADE_MS / 1000 / AUDIO_PTIME) * self.chunk_size
+        )
+
+    def stop(self):
+        super().stop()
+        self.pacer.close()
+        if self.current_job is not None:
+            self.current_job.cancel()
+        self._process_audio_task.cancel()
+
+    def add_speaking_listener(self, listener: Callable[[bool], None]):
+        # listeners run inside the media clock's frame batch, keep them short
+        self._speaking_listeners.append(listener)
+
+    def remove_speaking_listener(self, listener: Callable[[bool], None]):
+        if listener in self._speaking_listeners:
+            self._speaking_listeners.remove(listener)
+
+    def set_speaking(self, speaking: bool):
+        if self.is_speaking == speaking:
+            return
+        self.is_speaking = speaking
+        if speaking:
+            print("Interviewer is speaking")
+            self.not_speaking.clear()
+        else:
+            print("Interviewer is not speaking")
+            self.not_speaking.set()
+
+        for listener in list(self._speaking_listeners):
             try:
-                if (self._process_audio_task_queue.empty()):
-                    while True:
-                        if len(self.frame_buffer) > 0:
-                            time.sleep(0.5)
-                            continue
-                        print("Interviewer is not speaking")
-                        break
+                listener(speaking)
             except Exception as e:
-                print("Error while updating chracter state")
+                print("Error while notifying speaking state", e)
+
+    def speaking_reply(self) -> bool:
+        # a filler clip is not the reply
+        return self.is_speaking and not self._filler_active
+
+    def interrupt(self, keep_filler: bool = False) -> Optional[int]:
+        """Stop the current reply within one ptime.
+
+        Returns how many bytes of it were played, None if nothing was playing.
+        """
+        if self.handle_interruption != True:
+            return None
+
+        played = self.played_bytes()
+        if not (keep_filler and self._filler_active):
+            self.ring_buffer.clear()
+            self._filler_active = False
+        while not self._process_audio_task_queue.empty():
+            self._process_audio_task_queue.get_nowait().cancel()
+            self._process_audio_task_queue.task_done()
+
+        # cancelling closes the source stream, and with it the upstream tts and llm requests
+        self._first_frame_job = None
+        if self.current_job is not None:
+            self.current_job.cancel()
+
+        # wake the producer if it is waiting for space
+        self._space_available.set()
+        return played
+
+    def played_bytes(self) -> Optional[int]:
+        if not self._producing and self.ring_buffer.available == 0:
+            return None
+        job = self.current_job
+        if job is None or job.start_position is None:
+            # reply requested but no audio yet
+            return 0
+        return max(0, self.ring_buffer.read_position - job.start_position)
+
+    def add_new_bytes(self, bytes: Union[Iterator[bytes], AsyncIterator[bytes]]) -> TTSJob:
+        # a playing filler is kept until the reply actually produces audio
+        self.interrupt(keep_filler=True)
+        job = TTSJob(source=bytes)
+        self._process_audio_task_queue.put_nowait(job)
+        return job
+
+    def play_filler(self, pcm: bytes) -> bool:
+        """Play a filler clip while the next reply has produced no audio yet. Returns whether it was queued."""
+        if self.is_speaking or self.ring_buffer.available > 0:
+            return False
 
+        padding = -len(pcm) % self.chunk_size
+        pcm = bytes(pcm) + bytes(padding)
+        if len(pcm) > self.ring_buffer.free:
+            return False
+
+        self.ring_buffer.write(pcm)
+        self._filler_active = True
+        return True
+
+    def stop_filler(self):
+        # only the acknowledgement is cut, a reply that is still coming plays as usual
+        if self._filler_active:
+            self.fade_out_filler()
+
+    def fade_out_filler(self):
+        # keep only the next few frames of the filler and ramp them down to silence
+        self._filler_active = False
+        fade_size = min(self.ring_buffer.available, self.filler_fade_bytes)
+        tail = self.ring_buffer.peek(fade_size) if fade_size > 0 else None
+        self.ring_buffer.clear()
+        if tail is None:
+            return
+
+        samples = np.frombuffer(tail, dtype=np.int16).astype(np.float32)
+        samples *= np.linspace(1.0, 0.0, num=samples.size, dtype=np.float32)
+        self.ring_buffer.write(samples.astype(np.int16).tobytes())
+
+    async def iterate_audio_stream(self, audio_data_stream):
+        if hasattr(audio_data_stream, "__anext__"):
             try:
-                audio_data_stream = asyncio.run_coroutine_threadsafe(
-                   self._process_audio_task_queue.get(), self.loop
-                ).result()
-                for audio_data in audio_data_stream:
-                    try:
-                        if self.skip_next_chunk:
-                            print("Skipping Next Chunk")
-                            self.frame_buffer.clear()
-                            self.skip_next_chunk = False
-                            break
-
-                        self.audio_data_buffer += audio_data
-                        while len(self.audio_data_buffer) > self.chunk_size:
-                            chunk = self.audio_data_buffer[: self.chunk_size]
-                            self.audio_data_buffer = self.audio_data_buffer[
-                                self.chunk_size :
-                            ]
-
-                            # bytes to av.AudioFrame
-                            audio_frame = build_audio_frame(chunk)
-                            
-                            # append frame into frame buffer
-                            self.frame_buffer.append(audio_frame)
-                            # print("Interviewer is Speaking")
-                    except Exception as e:
-                        print("Error while putting audio data stream", e)
+                async for audio_data in audio_data_stream:
+                    yield audio_data
+            finally:
+                # an interrupted reply closes its source right away instead of on gc
+                if hasattr(audio_data_stream, "aclose"):
+                    await audio_data_stream.aclose()
+            return
+
+        # blocking iterators are pulled in the default executor
+        audio_data_stream = iter(audio_data_stream)
+        while True:
+            audio_data = await self.loop.run_in_executor(
+                None, next, audio_data_stream, None
+            )
+            if audio_data is None:
+                return
+            yield audio_data
+
+    async def process_incoming_audio(self):
+        while True:
+            try:
+                job = await self._process_audio_task_queue.get()
+                if job.cancelled:
+                    continue
+                self.current_job = job
+                self._producing = True
+                job.task = self.loop.create_task(self.play_job(job))
+                try:
+                    # returns when the job ends or is cancelled
+                    await asyncio.wait([job.task])
+                except asyncio.CancelledError:
+                    job.cancel()
+                    raise
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 traceback.print_exc()
                 print("Error while process audio", e)
+            finally:
+                self._producing = False
+
+    async def play_job(self, job: TTSJob):
+        try:
+            async with aclosing(self.iterate_audio_stream(job.source)) as audio_data_iterator:
+                async for audio_data in audio_data_iterator:
+                    try:
+                        if self._filler_active:
+                            self.fade_out_filler()
+                        if job.start_position is None:
+                            job.start_position = self.ring_buffer.write_position
+                            self._first_frame_job = job
+                            if self.tracer is not None:
+                                self.tracer.mark("first_frame_enqueued")
+
+                        await self.write_audio_data(audio_data)
+                    except Exception as e:
+                        print("Error while putting audio data stream", e)
+
+            # pad the tail so the last partial chunk is played as well
+            padding = -self.ring_buffer.available % self.chunk_size
+            if padding:
+                await self.write_audio_data(bytes(padding))
+        except Exception as e:
+            traceback.print_exc()
+            print("Error while process audio", e)
+
+    async def write_audio_data(self, audio_data: bytes):
+        audio_data = memoryview(audio_data)
+        while len(audio_data) > 0:
+            # only fill up to the high watermark, the rest waits and so does the source
+            room = self.high_watermark - self.ring_buffer.available
+            written = self.ring_buffer.write(audio_data[: max(room, 0)])
+            audio_data = audio_data[written:]
+            if len(audio_data) > 0:
+                # buffer is at the watermark, wait for recv to drain a frame
+                self._space_available.clear()
+                await self._space_available.wait()
 
     def next_timestamp(self):
         # Compute the next timestamp for the audio frame
@@ -128,30 +317,40 @@ class CustomAudioStreamTrack(AudioStreamTrack):
             if self.readyState != "live":
                 raise MediaStreamError
 
-            if self._start is None:
-                self._start = time.time()
-                self._timestamp = 0
-            else:
-                self._timestamp += self.samples
-
-            wait = self._start + (self._timestamp / self.sample_rate) - time.time()
+            # built by the media clock in the batch of the frame's tick
+            return await self.pacer.next_frame(self.build_frame)
+        except Exception as e:
+            traceback.print_exc()
+            print("error while creating tts->rtc frame", e)
 
-            if wait > 0:
-                await asyncio.sleep(wait)
+    def build_frame(self, skipped: int) -> AudioFrame:
+        if skipped:
+            # frames dropped by a resync still advance the media timestamps
+            self.frame_time += skipped * self.samples
 
-            pts, time_base = self.next_timestamp()
+        pts, time_base = self.next_timestamp()
 
-            if len(self.frame_buffer) > 0:
-                frame = self.frame_buffer.pop(0)
-            else:
-                frame = AudioFrame(format="s16", layout="mono", samples=self.samples)
-                for p in frame.planes:
-                    p.update(bytes(p.buffer_size))
+        chunk = self.ring_buffer.peek(self.chunk_size)
+        if chunk is not None:
+            # bytes to av.AudioFrame
+            frame = self.frame_pool.acquire(chunk)
+            self.ring_buffer.consume(self.chunk_size)
+            self._space_available.set()
+            self.set_speaking(True)
+            job = self._first_frame_job
+            if job is not None and self.ring_buffer.read_position > job.start_position:
+                # a filler still playing ahead of the reply doesn't count
+                self._first_frame_job = None
+                if self.tracer is not None:
+                    self.tracer.mark("first_frame_sent")
+                    self.tracer.finish("played")
+        else:
+            frame = self.silence_frame
+            self._filler_active = False
+            if not self._producing:
+                # buffer drained and nothing left to produce
+                self.set_speaking(False)
 
-            frame.pts = pts
-            frame.time_base = time_base
-            frame.sample_rate = self.sample_rate
-            return frame
-        except Exception as e:
-            traceback.print_exc()
-            print("error while creating tts->rtc frame", e)
\ No newline at end of file
+        frame.pts = pts
+        frame.time_base = time_base
+        return frame
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import traceback
+from typing import Optional, Tuple
+
+
+CONTROL_HOST = "127.0.0.1"
+CONTROL_PORT = 8090
+# largest request body the control api reads
+CONTROL_MAX_BODY = 64 * 1024
+
+HTTP_REASONS = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    500: "Internal Server Error",
+}
+
+
+async def read_request(
+    reader: asyncio.StreamReader, max_body: Optional[int] = CONTROL_MAX_BODY
+) -> Tuple[str, str, dict]:
+    """Method, path and json body of one http/1.1 request, ValueError if it is malformed."""
+    request_line = (await reader.readline()).decode("latin-1").split()
+    if len(request_line) < 2:
+        raise ValueError("bad request line")
+    method, path = request_line[0].upper(), request_line[1]
+
+    length = 0
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value.strip())
+
+    if max_body is not None and length > max_body:
+        raise ValueError("body too large")
+    body = {}
+    if length > 0:
+        body = json.loads(await reader.readexactly(length))
+    return method, path, body
+
+
+class ControlServer:
+    """Local http control api for an AgentHost or a Supervisor.
+
+    GET /sessions, POST /sessions {"room_id", "token"}, DELETE /sessions/<room_id>,
+    GET /metrics (turn latency percentiles per stage, audio pacing stats, stt ingest per peer)
+
+    target provides start_session(room_id, token), stop_session(room_id),
+    describe() and metrics(); start_session raises ValueError for a room that is already running.
+    """
+
+    def __init__(self, target, host: str = CONTROL_HOST, port: int = CONTROL_PORT):
+        self.target = target
+        self.host = host
+        self.port = port
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        print(f"Control api listening on {self.host}:{self.port}")
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            method, path, body = await read_request(reader)
+            status, payload = await self.dispatch(method, path, body)
+        except ValueError as e:
+            status, payload = 400, {"error": str(e)}
+        except Exception as e:
+            traceback.print_exc()
+            status, payload = 500, {"error": str(e)}
+
+        data = json.dumps(payload).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1")
+            + data
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def dispatch(self, method: str, path: str, body: dict) -> Tuple[int, dict]:
+        parts = [part for part in path.split("?")[0].split("/") if part]
+        if parts == ["metrics"]:
+            if method == "GET":
+                return 200, await self.target.metrics()
+            return 405, {"error": "method not allowed"}
+
+        if parts[:1] != ["sessions"] or len(parts) > 2:
+            return 404, {"error": "not found"}
+
+        if method == "GET" and len(parts) == 1:
+            return 200, self.target.describe()
+
+        if method == "POST" and len(parts) == 1:
+            room_id = body.get("room_id")
+            token = body.get("token")
+            if not room_id or not token:
+                raise ValueError("room_id and token are required")
+            if room_id in self.target.describe()["sessions"]:
+                return 409, {"error": "session already running"}
+            await self.target.start_session(room_id=room_id, token=token)
+            return 201, {"room_id": room_id}
+
+        if method == "DELETE" and len(parts) == 2:
+            if await self.target.stop_session(parts[1]):
+                return 200, {"room_id": parts[1]}
+            return 404, {"error": "no such session"}
+
+        return 405, {"error": "method not allowed"}
@@ -0,0 +1,61 @@
+import asyncio
+from typing import List, Optional
+
+
+# a filler clip is played if the reply has not started this long after the end of a turn
+FILLER_DEADLINE_MS = 800
+
+
+class FillerAudio:
+    """Short pre-rendered acknowledgements ("mm-hmm", "let me think") to mask a slow reply.
+
+    arm() is called when the user's turn ends; if the track has not started
+    speaking by the deadline, the next clip is handed to the track, which
+    fades it out as soon as the real reply arrives.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, track, deadline_ms: int = FILLER_DEADLINE_MS):
+        self.loop = loop
+        self.track = track
+        self.deadline_ms = deadline_ms
+        self.clips: List[bytes] = []
+        self.index = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+        # real audio reaching the track first makes the filler unnecessary
+        self.track.add_speaking_listener(self.on_speaking)
+
+    def add_clip(self, pcm: bytes):
+        if pcm:
+            self.clips.append(pcm)
+
+    def arm(self):
+        self.cancel()
+        if not self.clips:
+            return
+        self.timer = self.loop.call_later(self.deadline_ms / 1000, self.fire)
+
+    def cancel(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def stop(self):
+        # the user talks over it, a playing clip goes as well as a pending one
+        self.cancel()
+        self.track.stop_filler()
+
+    def on_speaking(self, speaking: bool):
+        if speaking:
+            self.cancel()
+
+    def fire(self):
+        self.timer = None
+        if self.track.is_speaking:
+            return
+
+        # rotate through the clips so the same one is not heard twice in a row
+        clip = self.clips[self.index % len(self.clips)]
+        self.index += 1
+        if self.track.play_filler(clip):
+            print("Playing filler audio")
@@ -0,0 +1,294 @@
+import asyncio
+from typing import Dict, List, Optional
+from agent.agent import AIInterviewer
+from agent.audio_stream_track import CustomAudioStreamTrack, AUDIO_PTIME
+from agent.filler import FillerAudio, FILLER_DEADLINE_MS
+from agent.media_clock import MediaClock
+from agent.subscription import SubscriptionPolicy, check_consumer_hooks, parse_subscriptions
+from agent.tracing import LatencyStats, TurnTracer
+from intelligence.intelligence_client import OpenAIIntelligence, create_openai_client
+from intelligence.retrieval import ContextRetriever, HashingEmbedder, VectorIndex, load_documents
+from stt.deepgram_stt import DeepgramSTT, create_deepgram_client
+from tts.elevenlabs_tts import ElevenLabsTTS, create_elevenlabs_client
+from tts.phrase_cache import PhraseCache
+
+
+class AgentSession:
+    """One interviewer in one room: its own track, history and peer connections, shared api clients."""
+
+    def __init__(self, host: "AgentHost", room_id: str):
+        self.host = host
+        self.room_id = room_id
+        self.loop = host.loop
+
+        # stage timestamps of each turn, exported to the host's latency stats
+        self.tracer = TurnTracer(stats=host.latency_stats, session_id=room_id)
+
+        self.audio_track = CustomAudioStreamTrack(
+            loop=self.loop, handle_interruption=True, tracer=self.tracer, clock=host.media_clock
+        )
+
+        self.tts = ElevenLabsTTS(
+            api_key=host.tts_api_key,
+            output_track=self.audio_track,
+            cache=host.cache,
+            elevenlabs_client=host.elevenlabs_client,
+            tracer=self.tracer,
+        )
+
+        self.intelligence = OpenAIIntelligence(
+            api_key=host.llm_api_key,
+            model=host.model,
+            tts=self.tts,
+            retriever=host.retriever,
+            openai_client=host.openai_client,
+            tracer=self.tracer,
+        )
+
+        self.filler = FillerAudio(
+            loop=self.loop, track=self.audio_track, deadline_ms=host.filler_deadline_ms
+        )
+        for clip in host.filler_clips:
+            self.filler.add_clip(clip)
+
+        self.stt = DeepgramSTT(
+            loop=self.loop,
+            api_key=host.stt_api_key,
+            language=host.language,
+            intelligence=self.intelligence,
+            vad_options=host.vad_options,
+            peer_vad_options=host.peer_vad_options,
+            speculative=host.speculative,
+            filler=self.filler,
+            deepgram_client=host.deepgram_client,
+            tracer=self.tracer,
+        )
+
+        self.interviewer = AIInterviewer(
+            loop=self.loop,
+            audio_track=self.audio_track,
+            stt=self.stt,
+            intelligence=self.intelligence,
+            subscriptions=host.subscriptions,
+            on_first_participant=self.greet,
+        )
+
+    def greet(self):
+        # rendered at startup, so the interview opens without an llm or tts request
+        if not self.host.opening_clip:
+            return
+        print(f"[Interviewer]: {self.host.opening_phrase}")
+        self.audio_track.add_new_bytes(iter([self.host.opening_clip]))
+        self.intelligence.add_response(self.host.opening_phrase)
+
+    async def start(self, token: str):
+        await self.stt.prewarm()
+        await self.interviewer.join(meeting_id=self.room_id, token=token)
+
+    async def stop(self):
+        try:
+            await self.interviewer.leave()
+        except Exception as e:
+            print("Error while leaving meeting", self.room_id, e)
+        self.filler.cancel()
+        self.tracer.finish("stopped")
+        self.stt.close()
+        self.intelligence.close()
+        self.audio_track.stop()
+
+
+class AgentHost:
+    """Runs many interviewer sessions on one event loop.
+
+    The LLM, TTS and STT clients (and their connection pools) and the phrase
+    cache are created once and shared by every session. Sessions are started
+    and stopped with start_session/stop_session, or over http with agent.control.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        stt_api_key: str,
+        tts_api_key: str,
+        llm_api_key: str,
+        language: str = "en-US",
+        model: str = "gpt-4o",
+        cache: Optional[PhraseCache] = None,
+        retriever: Optional[ContextRetriever] = None,
+        opening_phrase: Optional[str] = None,
+        filler_phrases: Optional[List[str]] = None,
+        filler_deadline_ms: int = FILLER_DEADLINE_MS,
+        vad_options: Optional[dict] = None,
+        peer_vad_options: Optional[Dict[str, dict]] = None,
+        speculative: bool = True,
+        trace_file: Optional[str] = None,
+        stt_url: Optional[str] = None,
+        llm_base_url: Optional[str] = None,
+        tts_base_url: Optional[str] = None,
+        subscriptions: Optional[Dict[str, str]] = None,
+    ):
+        self.loop = loop
+        self.stt_api_key = stt_api_key
+        self.tts_api_key = tts_api_key
+        self.llm_api_key = llm_api_key
+        self.language = language
+        self.model = model
+        self.cache = cache
+        self.retriever = retriever
+        # spoken when the candidate joins, before anyone has said anything
+        self.opening_phrase = (opening_phrase or "").strip()
+        self.filler_phrases = [p for p in filler_phrases or [] if p.strip()]
+        self.filler_deadline_ms = filler_deadline_ms
+        # EnergyVAD overrides for every peer, e.g. {"threshold_db": -50.0},
+        # and per peer id or display name on top of them
+        self.vad_options = vad_options or {}
+        self.peer_vad_options = peer_vad_options or {}
+        # an llm request on every stable interim transcript, faster replies for more tokens
+        self.speculative = speculative
+
+        # pooled clients shared by all sessions, the urls default to the public apis
+        self.openai_client = create_openai_client(
+            llm_api_key, base_url=llm_base_url or "https://api.openai.com/v1"
+        )
+        self.elevenlabs_client = create_elevenlabs_client(tts_api_key, base_url=tts_base_url)
+        self.deepgram_client = create_deepgram_client(stt_api_key, url=stt_url)
+
+        # rendered once, every session plays the same clips
+        self.opening_clip = b""
+        self.filler_clips: List[bytes] = []
+
+        # turn latencies of all sessions, per-turn json lines go to trace_file
+        self.latency_stats = LatencyStats(path=trace_file)
+
+        # stream kind -> decode, drain or decline, validated before any session joins
+        self.subscriptions = SubscriptionPolicy(subscriptions)
+        if self.subscriptions.filtered:
+            check_consumer_hooks()
+
+        # one pacing timer for the outbound audio of every session
+        self.media_clock = MediaClock(loop=loop, ptime=AUDIO_PTIME)
+
+        self.sessions: Dict[str, AgentSession] = {}
+
+    async def prewarm(self):
+        # session-less wrappers, only used to open the shared pools and fill the cache
+        tts = ElevenLabsTTS(
+            api_key=self.tts_api_key,
+            output_track=None,
+            cache=self.cache,
+            elevenlabs_client=self.elevenlabs_client,
+        )
+        intelligence = OpenAIIntelligence(
+            api_key=self.llm_api_key,
+            model=self.model,
+            tts=tts,
+            openai_client=self.openai_client,
+        )
+
+        print("Prewarming clients...")
+        await asyncio.gather(
+            intelligence.prewarm(),
+            tts.prewarm(),
+        )
+        if self.opening_phrase:
+            try:
+                self.opening_clip = await tts.render(self.opening_phrase)
+            except Exception as e:
+                print("Error while rendering opening phrase", e)
+        for phrase in self.filler_phrases:
+            try:
+                self.filler_clips.append(await tts.render(phrase))
+            except Exception as e:
+                print("Error while rendering filler", phrase, e)
+
+    async def start_session(self, room_id: str, token: str) -> AgentSession:
+        if room_id in self.sessions:
+            raise ValueError(f"session for room {room_id} already running")
+
+        print("Starting session", room_id)
+        session = AgentSession(host=self, room_id=room_id)
+        self.sessions[room_id] = session
+        try:
+            await session.start(token=token)
+        except Exception:
+            self.sessions.pop(room_id, None)
+            await session.stop()
+            raise
+        return session
+
+    async def stop_session(self, room_id: str) -> bool:
+        session = self.sessions.pop(room_id, None)
+        if session is None:
+            return False
+        print("Stopping session", room_id)
+        await session.stop()
+        return True
+
+    async def stop_all(self):
+        await asyncio.gather(
+            *[self.stop_session(room_id) for room_id in list(self.sessions)]
+        )
+
+    async def close(self):
+        await self.stop_all()
+        self.latency_stats.close()
+        self.media_clock.close()
+
+    def describe(self) -> dict:
+        return {"sessions": sorted(self.sessions)}
+
+    def ingest_metrics(self) -> Dict[str, Dict[str, dict]]:
+        # room -> peer -> stt packets sent
+        return {room_id: session.stt.get_ingest_metrics() for room_id, session in self.sessions.items()}
+
+    async def metrics(self) -> dict:
+        return {
+            "latency": self.latency_stats.summary(),
+            "media_clock": self.media_clock.stats(),
+            "ingest": self.ingest_metrics(),
+        }
+
+
+def build_host(loop: asyncio.AbstractEventLoop, options: dict) -> AgentHost:
+    """AgentHost from plain options, also used by supervisor workers (options must be picklable).
+
+    options: stt_api_key, tts_api_key, llm_api_key, language, model, tts_cache_dir,
+    rag_sources, rag_index_dir, rag_embedder (an Embedder, HashingEmbedder by default),
+    opening_phrase, filler_phrases, filler_deadline_ms, vad_options, peer_vad_options, speculative,
+    trace_file, stt_url, llm_base_url, tts_base_url, subscriptions ("audio=decode,video=decline" or a dict)
+    """
+    subscriptions = options.get("subscriptions")
+
+    # context retrieval, the index file is memory-mapped so workers share its pages
+    retriever = None
+    documents = load_documents(options.get("rag_sources") or {})
+    if documents:
+        embedder = options.get("rag_embedder") or HashingEmbedder()
+        retriever = ContextRetriever(
+            index=VectorIndex.load_or_build(options["rag_index_dir"], documents, embedder),
+            embedder=embedder,
+        )
+
+    return AgentHost(
+        loop=loop,
+        stt_api_key=options["stt_api_key"],
+        tts_api_key=options["tts_api_key"],
+        llm_api_key=options["llm_api_key"],
+        language=options.get("language", "en-US"),
+        model=options.get("model", "gpt-4o"),
+        cache=PhraseCache(cache_dir=options.get("tts_cache_dir")),
+        retriever=retriever,
+        opening_phrase=options.get("opening_phrase"),
+        filler_phrases=options.get("filler_phrases"),
+        filler_deadline_ms=options.get("filler_deadline_ms", FILLER_DEADLINE_MS),
+        vad_options=options.get("vad_options"),
+        peer_vad_options=options.get("peer_vad_options"),
+        speculative=options.get("speculative", True),
+        trace_file=options.get("trace_file"),
+        stt_url=options.get("stt_url"),
+        llm_base_url=options.get("llm_base_url"),
+        tts_base_url=options.get("tts_base_url"),
+        subscriptions=(
+            parse_subscriptions(subscriptions) if isinstance(subscriptions, str) else subscriptions
+        ),
+    )
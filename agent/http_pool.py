@@ -0,0 +1,10 @@
+import httpx
+
+
+# pooled connections are kept open between turns instead of the httpx default of 5 s,
+# the api clients built with these limits are created once per AgentHost and shared by its sessions
+HTTP_KEEPALIVE_EXPIRY = 300
+
+
+def pooled_limits() -> httpx.Limits:
+    return httpx.Limits(keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
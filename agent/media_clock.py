@@ -0,0 +1,246 @@
+import asyncio
+from collections import deque
+import itertools
+import math
+import time
+from typing import Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+import weakref
+from agent.tracing import percentiles
+
+
+MEDIA_CLOCK_PTIME = 0.02
+# a track further behind than this drops the backlog instead of bursting it out
+MEDIA_CLOCK_MAX_LAG = 0.2
+# frames a late track may release per tick while catching up (2 = twice real time)
+MEDIA_CLOCK_CATCH_UP_FRAMES = 2
+# frames released later than this after their deadline count as late
+MEDIA_CLOCK_LATE_THRESHOLD = 0.01
+# share of ptime one tick's batch may take before it counts as an overrun,
+# the rest of the loop (stt, llm, tts streams) needs the remainder
+MEDIA_CLOCK_BATCH_BUDGET = 0.5
+# the timer may fire a hair before the tick it was set for
+MEDIA_CLOCK_EPSILON = 1e-4
+# samples kept for the percentiles
+MEDIA_CLOCK_WINDOW = 500
+
+T = TypeVar("T")
+
+
+class MediaClock:
+    """Monotonic ptime grid and frame scheduler shared by outbound tracks.
+
+    Deadlines are ticks of the loop's monotonic clock (wall clock jumps
+    don't move them). A track waiting for its next frame is parked in the
+    wheel slot of its tick, and a single loop timer per tick builds the
+    frames of all tracks due at that tick in one batch, so a process with
+    many tracks has one timer callback per ptime instead of one sleep per
+    track per frame. The batch starts at a different track every tick so
+    none is always served last, and a batch that takes more than its share
+    of ptime is counted as an overrun.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        ptime: float = MEDIA_CLOCK_PTIME,
+        max_lag: float = MEDIA_CLOCK_MAX_LAG,
+    ):
+        self.loop = loop
+        self.ptime = ptime
+        self.max_lag = max_lag
+        self.epoch = loop.time()
+
+        # tick -> parked tracks: pacer, the callback building its frame and the recv waiting for it
+        self.wheel: Dict[int, List[Tuple["MediaPacer", Callable, asyncio.Future]]] = {}
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.timer_tick: Optional[int] = None
+
+        self.pacers: "weakref.WeakSet[MediaPacer]" = weakref.WeakSet()
+        self._pacer_ids = itertools.count()
+        self.ticks = 0
+        self.overruns = 0
+        self.max_batch = 0
+        # how late the shared timer fired, event loop jitter
+        self.timer_lag: Deque[float] = deque(maxlen=MEDIA_CLOCK_WINDOW)
+        # time spent building each tick's frames
+        self.batch_time: Deque[float] = deque(maxlen=MEDIA_CLOCK_WINDOW)
+
+    def tick_at(self, now: float) -> int:
+        return math.floor((now - self.epoch + MEDIA_CLOCK_EPSILON) / self.ptime)
+
+    def time_of(self, tick: int) -> float:
+        return self.epoch + tick * self.ptime
+
+    def pacer(self) -> "MediaPacer":
+        pacer = MediaPacer(self, next(self._pacer_ids))
+        self.pacers.add(pacer)
+        return pacer
+
+    def park(self, tick: int, pacer: "MediaPacer", produce: Callable) -> asyncio.Future:
+        """Future resolved with produce()'s frame in the batch of tick."""
+        future = self.loop.create_future()
+        self.wheel.setdefault(tick, []).append((pacer, produce, future))
+        if self.timer_tick is None or tick < self.timer_tick:
+            self.schedule(tick)
+        return future
+
+    def schedule(self, tick: int):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer_tick = tick
+        self.timer = self.loop.call_at(self.time_of(tick), self.on_timer)
+
+    def on_timer(self):
+        self.timer = None
+        self.timer_tick = None
+        now = self.loop.time()
+        current = self.tick_at(now)
+
+        due = sorted(tick for tick in self.wheel if tick <= current)
+        if due:
+            self.timer_lag.append(now - self.time_of(due[0]))
+            self.run_batch([entry for tick in due for entry in self.wheel.pop(tick)])
+
+        if self.wheel:
+            self.schedule(min(self.wheel))
+
+    def run_batch(self, batch: List[Tuple["MediaPacer", Callable, asyncio.Future]]):
+        # round robin over a stable order, a different track goes first every tick
+        batch.sort(key=lambda entry: entry[0].index)
+        start = self.ticks % len(batch)
+        self.ticks += 1
+        self.max_batch = max(self.max_batch, len(batch))
+
+        started_at = time.perf_counter()
+        for pacer, produce, future in batch[start:] + batch[:start]:
+            # a track whose recv was cancelled leaves a cancelled future behind
+            if future.done():
+                continue
+            try:
+                future.set_result(pacer.release(produce, 0))
+            except Exception as e:
+                future.set_exception(e)
+
+        elapsed = time.perf_counter() - started_at
+        self.batch_time.append(elapsed)
+        if elapsed > self.ptime * MEDIA_CLOCK_BATCH_BUDGET:
+            self.overruns += 1
+
+    def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+            self.timer_tick = None
+        for entries in self.wheel.values():
+            for _, _, future in entries:
+                future.cancel()
+        self.wheel.clear()
+
+    def stats(self) -> dict:
+        pacers = list(self.pacers)
+        lateness = [value for pacer in pacers for value in pacer.lateness]
+        return {
+            "tracks": len(pacers),
+            "ticks": self.ticks,
+            "timer_lag_ms": percentiles(self.timer_lag, scale=1000, digits=2),
+            "batch_ms": percentiles(self.batch_time, scale=1000, digits=2),
+            "max_batch": self.max_batch,
+            "overruns": self.overruns,
+            "frame_lateness_ms": percentiles(lateness, scale=1000, digits=2),
+            "frames": sum(pacer.frames for pacer in pacers),
+            "late_frames": sum(pacer.late_frames for pacer in pacers),
+            "catch_up_frames": sum(pacer.catch_up_frames for pacer in pacers),
+            "resyncs": sum(pacer.resyncs for pacer in pacers),
+            "skipped_frames": sum(pacer.skipped_frames for pacer in pacers),
+            # mean lateness of the worst track, a track that keeps drifting shows up here
+            "max_drift_ms": round(max((pacer.drift() for pacer in pacers), default=0.0) * 1000, 2),
+        }
+
+
+class MediaPacer:
+    """Frame schedule of one track on a MediaClock: frame n is due at tick start + n."""
+
+    def __init__(self, clock: MediaClock, index: int):
+        self.clock = clock
+        # position in the clock's round robin
+        self.index = index
+        self.start_tick: Optional[int] = None
+        self.frames = 0
+        self.parked: Optional[asyncio.Future] = None
+
+        # frames released in release_tick, bounds the catch-up rate
+        self.release_tick: Optional[int] = None
+        self.release_count = 0
+
+        self.late_frames = 0
+        self.catch_up_frames = 0
+        self.resyncs = 0
+        self.skipped_frames = 0
+        # release time minus deadline of recent frames
+        self.lateness: Deque[float] = deque(maxlen=MEDIA_CLOCK_WINDOW)
+
+    async def next_frame(self, produce: Callable[[int], T]) -> T:
+        """Wait until the next frame is due and return produce(skipped).
+
+        skipped is how many frames were dropped to resync. A frame that has
+        to wait is built in the clock's batch for its tick.
+        """
+        clock = self.clock
+        now = clock.loop.time()
+        current = clock.tick_at(now)
+        if self.start_tick is None:
+            # first frame goes out right away
+            self.start_tick = current
+
+        tick = self.start_tick + self.frames
+        if now - clock.time_of(tick) > clock.max_lag:
+            # stalled for long, catching up would burst a lot of audio at once
+            skipped = current - tick
+            self.start_tick += skipped
+            self.resyncs += 1
+            self.skipped_frames += skipped
+            return self.release(produce, skipped)
+
+        if tick < current:
+            # behind, catch up but at a bounded rate
+            self.catch_up_frames += 1
+            if self.release_tick == current and self.release_count >= MEDIA_CLOCK_CATCH_UP_FRAMES:
+                tick = current + 1
+            else:
+                return self.release(produce, 0)
+        elif tick == current:
+            return self.release(produce, 0)
+
+        self.parked = clock.park(tick, self, produce)
+        try:
+            return await self.parked
+        finally:
+            self.parked = None
+
+    def release(self, produce: Callable[[int], T], skipped: int) -> T:
+        clock = self.clock
+        released_at = clock.loop.time()
+        lateness = released_at - clock.time_of(self.start_tick + self.frames)
+        self.lateness.append(lateness)
+        if lateness > MEDIA_CLOCK_LATE_THRESHOLD:
+            self.late_frames += 1
+
+        release_tick = clock.tick_at(released_at)
+        if release_tick == self.release_tick:
+            self.release_count += 1
+        else:
+            self.release_tick = release_tick
+            self.release_count = 1
+
+        self.frames += 1
+        return produce(skipped)
+
+    def drift(self) -> float:
+        if not self.lateness:
+            return 0.0
+        return sum(self.lateness) / len(self.lateness)
+
+    def close(self):
+        if self.parked is not None and not self.parked.done():
+            self.parked.cancel()
+        self.clock.pacers.discard(self)
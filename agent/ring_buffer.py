@@ -0,0 +1,77 @@
+from typing import Optional
+
+
+class AudioRingBuffer:
+    """Fixed-capacity byte ring shared by one producer task and one consumer.
+
+    Both run on the same event loop, the producer only moves the write position
+    and the consumer only moves the read position, so neither side takes a lock.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+
+        # chunks that wrap around the end are stitched together here
+        self._scratch = bytearray()
+
+        # positions are absolute byte counts, the slot is position % capacity
+        self._write_pos = 0
+        self._read_pos = 0
+
+    @property
+    def available(self) -> int:
+        return self._write_pos - self._read_pos
+
+    @property
+    def write_position(self) -> int:
+        return self._write_pos
+
+    @property
+    def read_position(self) -> int:
+        return self._read_pos
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self.available
+
+    def write(self, data: bytes) -> int:
+        """Copy as much of data as fits, returns the number of bytes written."""
+        size = min(len(data), self.free)
+        if size <= 0:
+            return 0
+
+        data = memoryview(data)
+        start = self._write_pos % self.capacity
+        first = min(size, self.capacity - start)
+        self._view[start : start + first] = data[:first]
+        if size > first:
+            self._view[: size - first] = data[first:size]
+
+        self._write_pos += size
+        return size
+
+    def peek(self, size: int) -> Optional[memoryview]:
+        """View of the next size bytes without consuming them, None if not buffered yet."""
+        if self.available < size:
+            return None
+
+        start = self._read_pos % self.capacity
+        end = start + size
+        if end <= self.capacity:
+            return self._view[start:end]
+
+        if len(self._scratch) != size:
+            self._scratch = bytearray(size)
+        first = self.capacity - start
+        self._scratch[:first] = self._view[start:]
+        self._scratch[first:] = self._view[: size - first]
+        return memoryview(self._scratch)
+
+    def consume(self, size: int):
+        self._read_pos += min(size, self.available)
+
+    def clear(self):
+        # consumer side only, drops everything written so far
+        self._read_pos = self._write_pos
@@ -0,0 +1,132 @@
+import asyncio
+from typing import Dict, Optional, Set
+import weakref
+from videosdk._events import Events
+
+
+SUBSCRIBE_DECODE = "decode"
+SUBSCRIBE_DRAIN = "drain"
+SUBSCRIBE_DECLINE = "decline"
+SUBSCRIBE_ACTIONS = (SUBSCRIBE_DECODE, SUBSCRIBE_DRAIN, SUBSCRIBE_DECLINE)
+# the agent only listens, video (screenshare arrives as video as well) is never looked at
+DEFAULT_SUBSCRIPTIONS = {"audio": SUBSCRIBE_DECODE, "video": SUBSCRIBE_DECLINE}
+
+
+def check_consumer_hooks():
+    """Raises if the sdk no longer has the internals ConsumerFilter relies on.
+
+    None of them are public api, so an sdk upgrade would otherwise turn drain
+    and decline into plain decode without any error.
+    """
+    from videosdk.meeting import Meeting
+    from videosdk.room_client import RoomClient
+    from vsaiortc.rtcrtpreceiver import RTCRtpReceiver
+
+    missing = []
+    if not hasattr(Events, "ADD_CONSUMER"):
+        missing.append("videosdk._events.Events.ADD_CONSUMER")
+    if "_Meeting__room_client" not in Meeting.__init__.__code__.co_names:
+        missing.append("Meeting.__room_client")
+    if not callable(getattr(RoomClient, "on", None)):
+        missing.append("RoomClient.on")
+    if "_enabled" not in RTCRtpReceiver._handle_rtp_packet.__code__.co_names:
+        missing.append("RTCRtpReceiver._enabled")
+    if missing:
+        raise RuntimeError(
+            f"drained and declined streams need sdk internals that are gone: {', '.join(missing)}"
+        )
+
+
+def parse_subscriptions(text: Optional[str]) -> Dict[str, str]:
+    """"audio=decode,video=drain" to {"audio": "decode", "video": "drain"}."""
+    subscriptions = {}
+    for item in (text or "").split(","):
+        if not item.strip():
+            continue
+        kind, _, action = item.partition("=")
+        subscriptions[kind.strip()] = action.strip()
+    return subscriptions
+
+
+class SubscriptionPolicy:
+    """What the agent does with each kind of remote stream.
+
+    decode: the stream is received and decoded, audio goes to stt
+    drain: the stream stays subscribed, its packets are dropped before the jitter buffer and decoder
+    decline: the consumer is closed locally as soon as it is created, its receiver and decoder stop;
+        the sdk has no way to pause it on the server, so the sfu keeps sending and the packets are
+        dropped on arrival, this saves the decoding but not the bandwidth
+    """
+
+    def __init__(self, subscriptions: Optional[Dict[str, str]] = None, default: str = SUBSCRIBE_DECLINE):
+        self.subscriptions = {**DEFAULT_SUBSCRIPTIONS, **(subscriptions or {})}
+        self.default = default
+        for kind, action in [*self.subscriptions.items(), ("default", default)]:
+            if action not in SUBSCRIBE_ACTIONS:
+                raise ValueError(
+                    f"unknown subscription {action!r} for {kind}, expected one of {', '.join(SUBSCRIBE_ACTIONS)}"
+                )
+
+    def action(self, kind: str) -> str:
+        return self.subscriptions.get(kind, self.default)
+
+    @property
+    def filtered(self) -> bool:
+        # anything but decode goes through ConsumerFilter
+        return any(action != SUBSCRIBE_DECODE for action in [*self.subscriptions.values(), self.default])
+
+
+class ConsumerFilter:
+    """Applies drain and decline to the consumers of one meeting.
+
+    The sdk hands listeners a stream with its track only, and decoding runs in
+    the track's receiver whether or not anyone reads it, so this hooks the room
+    client's consumer events to reach the receiver before any frame is decoded.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, policy: SubscriptionPolicy):
+        self.loop = loop
+        self.policy = policy
+        self.drained: "weakref.WeakSet" = weakref.WeakSet()
+        self.tasks: Set[asyncio.Task] = set()
+
+    def attach(self, meeting):
+        # registered before joining, so it sees every consumer ahead of the participants
+        room_client = getattr(meeting, "_Meeting__room_client", None)
+        if room_client is None or not hasattr(room_client, "on"):
+            raise RuntimeError("room client not reachable, drained and declined streams would be decoded")
+        room_client.on(Events.ADD_CONSUMER, self.on_consumer_added)
+
+    def on_consumer_added(self, consumer):
+        try:
+            action = self.policy.action(consumer.kind)
+            if action == SUBSCRIBE_DRAIN and consumer.rtpReceiver is not None:
+                print(f"Subscriptions :: draining {consumer.kind} consumer {consumer.id}")
+                self.drained.add(consumer.rtpReceiver)
+            elif action == SUBSCRIBE_DECLINE:
+                print(f"Subscriptions :: declining {consumer.kind} consumer {consumer.id}")
+                task = self.loop.create_task(self.decline(consumer))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+            # consuming renegotiated the transport, which re-enables every receiver
+            self.disable_drained()
+        except Exception as e:
+            print("Error while applying subscription policy", e)
+
+    async def decline(self, consumer):
+        try:
+            # closes its media section, the receiver and its decoder thread stop
+            await consumer.close()
+        except Exception as e:
+            print("Error while declining consumer", e)
+        finally:
+            self.disable_drained()
+
+    def disable_drained(self):
+        # packets of a disabled receiver are dropped on arrival, see RTCRtpReceiver._handle_rtp_packet
+        for receiver in self.drained:
+            receiver._enabled = False
+
+    def close(self):
+        for task in list(self.tasks):
+            task.cancel()
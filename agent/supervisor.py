@@ -0,0 +1,425 @@
+import asyncio
+import itertools
+import multiprocessing
+from multiprocessing.connection import Connection
+import os
+import signal
+import time
+import traceback
+from typing import Dict, List, Optional
+from agent.tracing import merge_snapshots, summarize
+
+
+# workers are pinged this often and restarted if pings went unanswered for longer than the timeout
+SUPERVISOR_HEALTH_INTERVAL = 5.0
+SUPERVISOR_HEALTH_TIMEOUT = 20.0
+# how long a start/stop request may take in a worker (joining a meeting included)
+SUPERVISOR_REQUEST_TIMEOUT = 60.0
+# workers get this long to leave their meetings on shutdown before they are killed
+SUPERVISOR_DRAIN_TIMEOUT = 30.0
+# a worker that keeps crashing is restarted at most this often
+SUPERVISOR_RESTART_BACKOFF = 2.0
+
+
+class WorkerHandle:
+    """Supervisor side of one worker process."""
+
+    def __init__(self, index: int, core: Optional[int]):
+        self.index = index
+        self.core = core
+        self.process: Optional[multiprocessing.Process] = None
+        self.conn: Optional[Connection] = None
+        # room id -> token, kept so the rooms can be rejoined after a crash
+        self.sessions: Dict[str, str] = {}
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.ready = False
+        self.last_ping = 0.0
+        self.last_pong = 0.0
+        self.started_at = 0.0
+        self.restarts = 0
+        # respawn and rejoin of its rooms, runs beside the health loop
+        self.restart_task: Optional[asyncio.Task] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    @property
+    def restarting(self) -> bool:
+        return self.restart_task is not None and not self.restart_task.done()
+
+    def describe(self) -> dict:
+        return {
+            "index": self.index,
+            "pid": self.process.pid if self.process is not None else None,
+            "core": self.core,
+            "ready": self.ready,
+            "sessions": sorted(self.sessions),
+            "restarts": self.restarts,
+        }
+
+
+class Supervisor:
+    """Shards interviewer sessions over worker processes, one event loop and AgentHost per worker.
+
+    Each worker is pinned to a core so audio encoding, frame building and
+    inbound conversion of its sessions don't share a GIL with the others.
+    Workers are pinged for health, restarted (and their rooms rejoined) when
+    they crash or hang, and drained on shutdown.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        options: dict,
+        workers: Optional[int] = None,
+    ):
+        self.loop = loop
+        # passed to agent.host.build_host in every worker, must be picklable
+        self.options = options
+
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+        count = workers or len(cores) or os.cpu_count() or 1
+        self.workers = [
+            WorkerHandle(index=i, core=cores[i % len(cores)] if cores else None)
+            for i in range(count)
+        ]
+
+        # spawn instead of fork, a child never inherits the parent's loop or threads
+        self.context = multiprocessing.get_context("spawn")
+        self.request_ids = itertools.count(1)
+        self.health_task: Optional[asyncio.Task] = None
+        self.draining = False
+
+    async def start(self):
+        for worker in self.workers:
+            self.spawn(worker)
+        self.health_task = self.loop.create_task(self.health_loop())
+
+    def spawn(self, worker: WorkerHandle):
+        parent_conn, child_conn = self.context.Pipe()
+        worker.process = self.context.Process(
+            target=run_worker,
+            args=(worker.index, worker.core, child_conn, self.options),
+            name=f"interviewer-worker-{worker.index}",
+            daemon=True,
+        )
+        worker.process.start()
+        child_conn.close()
+
+        worker.conn = parent_conn
+        worker.ready = False
+        worker.started_at = time.monotonic()
+        worker.last_ping = worker.started_at
+        worker.last_pong = worker.started_at
+        self.loop.add_reader(parent_conn.fileno(), self.on_message, worker)
+        print(f"Worker {worker.index} started, pid {worker.process.pid}, core {worker.core}")
+
+    def on_message(self, worker: WorkerHandle):
+        try:
+            message = worker.conn.recv()
+        except (EOFError, OSError):
+            # worker exited, the health loop restarts it
+            self.loop.remove_reader(worker.conn.fileno())
+            return
+
+        kind = message.get("type")
+        if kind == "ready":
+            worker.ready = True
+            worker.last_pong = time.monotonic()
+        elif kind == "pong":
+            worker.last_pong = time.monotonic()
+        elif kind == "reply":
+            future = worker.pending.pop(message["id"], None)
+            if future is not None and not future.done():
+                future.set_result(message)
+
+    async def request(self, worker: WorkerHandle, kind: str, **fields) -> dict:
+        request_id = next(self.request_ids)
+        future = self.loop.create_future()
+        worker.pending[request_id] = future
+        worker.conn.send({"type": kind, "id": request_id, **fields})
+        try:
+            return await asyncio.wait_for(future, SUPERVISOR_REQUEST_TIMEOUT)
+        finally:
+            worker.pending.pop(request_id, None)
+
+    def find_worker(self, room_id: str) -> Optional[WorkerHandle]:
+        for worker in self.workers:
+            if room_id in worker.sessions:
+                return worker
+        return None
+
+    # same interface as AgentHost, used by the control api
+
+    async def start_session(self, room_id: str, token: str):
+        if self.draining:
+            raise ValueError("supervisor is shutting down")
+        if self.find_worker(room_id) is not None:
+            raise ValueError(f"session for room {room_id} already running")
+
+        # least loaded live worker
+        candidates = [w for w in self.workers if w.alive and w.conn is not None]
+        if not candidates:
+            raise RuntimeError("no live worker to start the session on")
+        worker = min(candidates, key=lambda w: len(w.sessions))
+
+        # reserved while joining so a second start for the room is refused
+        worker.sessions[room_id] = token
+        try:
+            reply = await self.request(worker, "start", room_id=room_id, token=token)
+        except BaseException:
+            worker.sessions.pop(room_id, None)
+            raise
+        if not reply.get("ok"):
+            worker.sessions.pop(room_id, None)
+            raise RuntimeError(reply.get("error") or f"could not start {room_id}")
+
+    async def stop_session(self, room_id: str) -> bool:
+        worker = self.find_worker(room_id)
+        if worker is None:
+            return False
+        worker.sessions.pop(room_id, None)
+        if worker.alive:
+            await self.request(worker, "stop", room_id=room_id)
+        return True
+
+    def describe(self) -> dict:
+        return {
+            "sessions": sorted(room for w in self.workers for room in w.sessions),
+            "workers": [w.describe() for w in self.workers],
+        }
+
+    async def metrics(self) -> dict:
+        # raw latencies of every worker, percentiles can't be merged
+        snapshots = []
+        workers = []
+        for worker in self.workers:
+            if not worker.alive or not worker.ready:
+                continue
+            try:
+                reply = await self.request(worker, "metrics")
+                snapshots.append(reply["metrics"])
+                # each worker paces its own tracks
+                workers.append({
+                    "index": worker.index,
+                    "media_clock": reply["media_clock"],
+                    "ingest": reply["ingest"],
+                })
+            except Exception as e:
+                print(f"Error while reading metrics of worker {worker.index}", e)
+        return {"latency": summarize(merge_snapshots(snapshots)), "workers": workers}
+
+    # health
+
+    async def health_loop(self):
+        while not self.draining:
+            await asyncio.sleep(SUPERVISOR_HEALTH_INTERVAL)
+            for worker in self.workers:
+                if self.draining:
+                    return
+                if worker.restarting:
+                    # judged again once its rooms are rejoined
+                    continue
+                if not worker.alive:
+                    print(f"Worker {worker.index} died, exit code {worker.process.exitcode}")
+                    self.schedule_restart(worker)
+                # measured from the last ping sent, a late health loop doesn't count against the worker
+                elif worker.last_ping - worker.last_pong > SUPERVISOR_HEALTH_TIMEOUT:
+                    print(f"Worker {worker.index} stopped answering health checks")
+                    self.schedule_restart(worker)
+                else:
+                    try:
+                        worker.conn.send({"type": "ping"})
+                        worker.last_ping = time.monotonic()
+                    except OSError:
+                        pass
+
+    def schedule_restart(self, worker: WorkerHandle):
+        # a restart waits on the rejoins, the other workers keep being pinged meanwhile
+        worker.restart_task = self.loop.create_task(self.restart(worker))
+
+    async def restart(self, worker: WorkerHandle):
+        self.stop_process(worker)
+
+        # don't spin on a worker that crashes right after start
+        uptime = time.monotonic() - worker.started_at
+        if uptime < SUPERVISOR_RESTART_BACKOFF:
+            await asyncio.sleep(SUPERVISOR_RESTART_BACKOFF - uptime)
+
+        worker.restarts += 1
+        self.spawn(worker)
+
+        # rejoin the rooms the crashed worker was running, all at once
+        await asyncio.gather(
+            *[self.rejoin(worker, room_id, token) for room_id, token in list(worker.sessions.items())]
+        )
+
+    async def rejoin(self, worker: WorkerHandle, room_id: str, token: str):
+        try:
+            reply = await self.request(worker, "start", room_id=room_id, token=token)
+            if not reply.get("ok"):
+                raise RuntimeError(reply.get("error"))
+        except Exception as e:
+            print("Error while restarting session", room_id, e)
+            worker.sessions.pop(room_id, None)
+
+    def stop_process(self, worker: WorkerHandle):
+        if worker.conn is not None:
+            try:
+                self.loop.remove_reader(worker.conn.fileno())
+            except (OSError, ValueError):
+                pass
+            worker.conn.close()
+            worker.conn = None
+        for future in worker.pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError("worker restarted"))
+        worker.pending.clear()
+        if worker.process is not None and worker.process.is_alive():
+            worker.process.kill()
+            worker.process.join(1)
+
+    # shutdown
+
+    async def drain(self):
+        """Let every worker leave its meetings, then stop the ones that don't exit in time."""
+        if self.draining:
+            return
+        self.draining = True
+        if self.health_task is not None:
+            self.health_task.cancel()
+        for worker in self.workers:
+            if worker.restarting:
+                worker.restart_task.cancel()
+
+        print("Draining workers...")
+        for worker in self.workers:
+            if worker.alive:
+                try:
+                    worker.conn.send({"type": "drain"})
+                except OSError:
+                    pass
+
+        deadline = time.monotonic() + SUPERVISOR_DRAIN_TIMEOUT
+        while any(w.alive for w in self.workers) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+        for worker in self.workers:
+            if worker.alive:
+                print(f"Worker {worker.index} did not drain in time")
+            self.stop_process(worker)
+
+
+def run_worker(index: int, core: Optional[int], conn: Connection, options: dict):
+    """Worker process entry point."""
+    if core is not None and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, {core})
+        except OSError as e:
+            print(f"Worker {index} could not pin to core {core}", e)
+
+    # ctrl-c reaches the whole process group, the supervisor drains the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    worker = Worker(loop=loop, index=index, conn=conn, options=options)
+    loop.add_signal_handler(signal.SIGTERM, worker.begin_drain)
+    try:
+        loop.run_until_complete(worker.run())
+    finally:
+        loop.close()
+
+
+class Worker:
+    """Worker side: an AgentHost driven by commands from the supervisor pipe."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, index: int, conn: Connection, options: dict):
+        self.loop = loop
+        self.index = index
+        self.conn = conn
+        self.options = options
+        self.host = None
+        self.draining = False
+        self.drained = asyncio.Event()
+        self.tasks: List[asyncio.Task] = []
+
+    async def run(self):
+        # imported here so the supervisor process never loads the media stack
+        from agent.host import build_host
+
+        self.host = build_host(self.loop, self.options)
+        self.loop.add_reader(self.conn.fileno(), self.on_command)
+        try:
+            await self.host.prewarm()
+        except Exception as e:
+            print(f"Worker {self.index} prewarm failed", e)
+        self.send({"type": "ready"})
+        await self.drained.wait()
+
+    def send(self, message: dict):
+        try:
+            self.conn.send(message)
+        except OSError:
+            pass
+
+    def on_command(self):
+        try:
+            message = self.conn.recv()
+        except (EOFError, OSError):
+            # supervisor is gone, leave the meetings and exit
+            self.loop.remove_reader(self.conn.fileno())
+            self.begin_drain()
+            return
+
+        kind = message.get("type")
+        if kind == "ping":
+            self.send({"type": "pong", "sessions": sorted(self.host.sessions)})
+        elif kind == "start":
+            self.tasks.append(self.loop.create_task(self.start_session(message)))
+        elif kind == "stop":
+            self.tasks.append(self.loop.create_task(self.stop_session(message)))
+        elif kind == "metrics":
+            self.send({
+                "type": "reply",
+                "id": message["id"],
+                "metrics": self.host.latency_stats.snapshot(),
+                "media_clock": self.host.media_clock.stats(),
+                "ingest": self.host.ingest_metrics(),
+            })
+        elif kind == "drain":
+            self.begin_drain()
+        self.tasks = [task for task in self.tasks if not task.done()]
+
+    async def start_session(self, message: dict):
+        if self.draining:
+            self.send({"type": "reply", "id": message["id"], "ok": False, "error": "worker is draining"})
+            return
+        try:
+            await self.host.start_session(room_id=message["room_id"], token=message["token"])
+            self.send({"type": "reply", "id": message["id"], "ok": True})
+        except Exception as e:
+            traceback.print_exc()
+            self.send({"type": "reply", "id": message["id"], "ok": False, "error": str(e)})
+
+    async def stop_session(self, message: dict):
+        stopped = await self.host.stop_session(message["room_id"])
+        self.send({"type": "reply", "id": message["id"], "ok": stopped})
+
+    def begin_drain(self):
+        if self.draining:
+            return
+        self.draining = True
+        self.loop.create_task(self.drain())
+
+    async def drain(self):
+        try:
+            for task in self.tasks:
+                task.cancel()
+            if self.host is not None:
+                await self.host.close()
+        except Exception as e:
+            print(f"Worker {self.index} error while draining", e)
+        finally:
+            self.drained.set()
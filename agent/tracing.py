@@ -0,0 +1,180 @@
+from collections import deque
+import itertools
+import json
+import time
+from typing import Deque, Dict, List, Optional
+import numpy as np
+
+
+# stages of one turn in pipeline order, all timestamps are time.monotonic()
+TRACE_STAGES = (
+    "last_word",
+    "speech_final",
+    "llm_request",
+    "llm_first_token",
+    "tts_first_byte",
+    "first_frame_enqueued",
+    "first_frame_sent",
+)
+# turns kept per stage for the percentiles
+TRACE_WINDOW = 1000
+TRACE_PERCENTILES = (50, 95, 99)
+
+
+def percentiles(values, scale: float = 1.0, digits: int = 1) -> dict:
+    """p50/p95/p99 of values multiplied by scale, empty without values."""
+    if len(values) == 0:
+        return {}
+    points = np.percentile(np.asarray(values, dtype=np.float64) * scale, TRACE_PERCENTILES)
+    return {f"p{percentile}": round(float(value), digits) for percentile, value in zip(TRACE_PERCENTILES, points)}
+
+
+def summarize(snapshot: dict) -> dict:
+    """p50/p95/p99 in ms of each stage from a LatencyStats snapshot."""
+    stages = {}
+    for stage, values in snapshot["latencies"].items():
+        if not values:
+            continue
+        stages[stage] = {"count": len(values), **percentiles(values)}
+    return {"turns": snapshot["turns"], "outcomes": snapshot["outcomes"], "stages": stages}
+
+
+def merge_snapshots(snapshots: List[dict]) -> dict:
+    merged = {"turns": 0, "outcomes": {}, "latencies": {stage: [] for stage in TRACE_STAGES[1:]}}
+    for snapshot in snapshots:
+        merged["turns"] += snapshot["turns"]
+        for outcome, count in snapshot["outcomes"].items():
+            merged["outcomes"][outcome] = merged["outcomes"].get(outcome, 0) + count
+        for stage, values in snapshot["latencies"].items():
+            merged["latencies"].setdefault(stage, []).extend(values)
+    return merged
+
+
+class LatencyStats:
+    """Per-stage latencies of finished turns, shared by all sessions of a host.
+
+    A stage's latency is measured from the end of the user's speech: the
+    estimated last word, or speech_final when there is no word timing.
+    Stages of a speculative reply can come out negative, its llm request
+    started before the user finished. Every turn is also appended to path
+    as one json line.
+    """
+
+    def __init__(self, window: int = TRACE_WINDOW, path: Optional[str] = None):
+        self.window = window
+        self.path = path
+        self.file = None
+        self.latencies: Dict[str, Deque[float]] = {
+            stage: deque(maxlen=window) for stage in TRACE_STAGES[1:]
+        }
+        self.turns = 0
+        self.outcomes: Dict[str, int] = {}
+
+    def record(self, session_id: str, turn: dict, outcome: str):
+        marks = turn["marks"]
+        origin_stage = "last_word" if "last_word" in marks else "speech_final"
+        origin = marks.get(origin_stage)
+        if origin is None:
+            return
+
+        latency_ms = {}
+        for stage in TRACE_STAGES:
+            if stage in marks and stage != origin_stage:
+                latency_ms[stage] = round((marks[stage] - origin) * 1000, 1)
+                if stage in self.latencies:
+                    self.latencies[stage].append(latency_ms[stage])
+
+        self.turns += 1
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+        if self.path:
+            self.write(
+                {
+                    "session": session_id,
+                    "turn": turn["id"],
+                    "peer": turn["peer"],
+                    "time": turn["time"],
+                    "outcome": outcome,
+                    "origin": origin_stage,
+                    "latency_ms": latency_ms,
+                }
+            )
+
+    def write(self, line: dict):
+        try:
+            if self.file is None:
+                # line buffered, each turn reaches the file in one append
+                self.file = open(self.path, "a", buffering=1)
+            self.file.write(json.dumps(line) + "\n")
+        except OSError as e:
+            print("Error while writing latency trace", e)
+
+    def snapshot(self) -> dict:
+        """Picklable copy of the raw latencies, merged across workers with merge_snapshots."""
+        return {
+            "turns": self.turns,
+            "outcomes": dict(self.outcomes),
+            "latencies": {stage: list(values) for stage, values in self.latencies.items()},
+        }
+
+    def summary(self) -> dict:
+        return summarize(self.snapshot())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class TurnTracer:
+    """Stage timestamps of the current turn of one session.
+
+    The stt begins a turn on the final transcript, the llm, tts and audio
+    track mark their stages as they get to them (only the first mark of a
+    stage counts) and the turn is exported once its first frame is sent,
+    or when it is interrupted or replaced by the next one.
+    """
+
+    def __init__(self, stats: LatencyStats, session_id: str):
+        self.stats = stats
+        self.session_id = session_id
+        self.turn_ids = itertools.count(1)
+        self.turn: Optional[dict] = None
+
+    def begin_turn(self, peer_name: str, last_word_at: Optional[float] = None):
+        if self.turn is not None:
+            self.finish("superseded")
+        now = time.monotonic()
+        self.turn = {
+            "id": next(self.turn_ids),
+            "peer": peer_name,
+            "time": time.time(),
+            "marks": {"speech_final": now},
+            "linked": [],
+        }
+        if last_word_at is not None:
+            self.turn["marks"]["last_word"] = min(last_word_at, now)
+
+    def mark(self, stage: str, at: Optional[float] = None):
+        if self.turn is None:
+            return
+        if stage not in self.turn["marks"]:
+            self.turn["marks"][stage] = at if at is not None else time.monotonic()
+
+    def link(self, marks: Dict[str, float]):
+        # marks kept outside the turn (a speculative llm request), read when the turn finishes
+        if self.turn is not None:
+            self.turn["linked"].append(marks)
+
+    def finish(self, outcome: str = "played"):
+        turn = self.turn
+        self.turn = None
+        if turn is None:
+            return
+        for marks in turn["linked"]:
+            for stage, at in marks.items():
+                turn["marks"].setdefault(stage, at)
+        try:
+            self.stats.record(self.session_id, turn, outcome)
+        except Exception as e:
+            print("Error while recording turn latency", e)
@@ -0,0 +1,43 @@
+import asyncio
+import itertools
+from typing import AsyncIterator, Callable, Iterator, List, Optional, Union
+
+
+_job_ids = itertools.count(1)
+
+
+class TTSJob:
+    """One utterance queued on the audio track: an id, its pcm source and a cancel handle.
+
+    Cancelling a job that is playing stops its task, which closes the source
+    and with it the upstream tts response. Audio already in the track's
+    buffer still plays, interrupt() on the track cuts that as well.
+    """
+
+    def __init__(self, source: Union[Iterator[bytes], AsyncIterator[bytes]]):
+        self.id = next(_job_ids)
+        self.source = source
+        self.task: Optional[asyncio.Task] = None
+        self.cancelled = False
+        self.cancel_callbacks: List[Callable[[], None]] = []
+
+        # ring buffer write position of the job's first byte, set once it produces audio
+        self.start_position: Optional[int] = None
+
+    def add_cancel_callback(self, callback: Callable[[], None]):
+        # for upstream work the source doesn't own, e.g. a speculative llm stream
+        self.cancel_callbacks.append(callback)
+
+    def cancel(self):
+        if self.cancelled:
+            return
+        self.cancelled = True
+        print(f"TTS job {self.id} cancelled")
+        # a job still in the queue is skipped by the track
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        for callback in self.cancel_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print("Error while cancelling tts job", e)
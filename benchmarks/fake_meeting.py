@@ -0,0 +1,166 @@
+'''
+Stand-ins for the VideoSDK side of a session: a participant whose audio stream
+replays wav files or synthetic speech, and a sink that pulls the agent's
+outbound track at ptime like the WebRTC sender does.
+'''
+import asyncio
+from fractions import Fraction
+import itertools
+import time
+from typing import List, Optional
+import wave
+from av import AudioFrame
+import numpy as np
+
+
+REPLAY_SAMPLE_RATE = 48000
+REPLAY_CHANNELS = 2
+REPLAY_PTIME = 0.02
+
+_track_ids = itertools.count(1)
+
+
+def load_wav(path: str) -> "Utterance":
+    with wave.open(path, "rb") as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError(f"{path}: only 16 bit pcm wav files are supported")
+        pcm = wav.readframes(wav.getnframes())
+        return Utterance(pcm, sample_rate=wav.getframerate(), channels=wav.getnchannels())
+
+
+def synthetic_utterance(
+    seconds: float,
+    sample_rate: int = REPLAY_SAMPLE_RATE,
+    channels: int = REPLAY_CHANNELS,
+) -> "Utterance":
+    """Voice-like tone with a syllable rate envelope, loud enough for the energy vads."""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    voice = sum(np.sin(2 * np.pi * 140 * k * t) / k for k in (1, 2, 3))
+    envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 4 * t)
+    samples = (voice * envelope * 0.08 * 32767).astype(np.int16)
+    return Utterance(np.repeat(samples, channels).tobytes(), sample_rate, channels)
+
+
+class Utterance:
+    def __init__(self, pcm: bytes, sample_rate: int, channels: int):
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+        self.channels = channels
+
+    @property
+    def seconds(self) -> float:
+        return len(self.pcm) / (self.sample_rate * self.channels * 2)
+
+
+class ReplayAudioTrack:
+    """Inbound audio of a fake participant, silence until an utterance is queued with say()."""
+
+    kind = "audio"
+
+    def __init__(self, sample_rate: int = REPLAY_SAMPLE_RATE, channels: int = REPLAY_CHANNELS):
+        self.id = f"fake-audio-{next(_track_ids)}"
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.samples = int(REPLAY_PTIME * sample_rate)
+        self.frame_size = self.samples * channels * 2
+        self.layout = "mono" if channels == 1 else "stereo"
+
+        self.pcm = b""
+        self.offset = 0
+        self.played = asyncio.Event()
+        self.played.set()
+
+        self._start: Optional[float] = None
+        self._timestamp = 0
+        self.stopped = False
+
+    async def say(self, utterance: Utterance, timeout: Optional[float] = None):
+        """Queue an utterance and wait until it has been received, asyncio.TimeoutError after timeout."""
+        if (utterance.sample_rate, utterance.channels) != (self.sample_rate, self.channels):
+            raise ValueError("utterance format doesn't match the track")
+        padding = -len(utterance.pcm) % self.frame_size
+        self.pcm = utterance.pcm + bytes(padding)
+        self.offset = 0
+        self.played.clear()
+        await asyncio.wait_for(self.played.wait(), timeout)
+
+    async def recv(self) -> AudioFrame:
+        if self.stopped:
+            raise EOFError("track stopped")
+
+        # paced like a jitter buffer releasing one frame per ptime
+        if self._start is None:
+            self._start = time.monotonic()
+        else:
+            self._timestamp += self.samples
+        wait = self._start + self._timestamp / self.sample_rate - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        if self.offset < len(self.pcm):
+            chunk = self.pcm[self.offset:self.offset + self.frame_size]
+            self.offset += self.frame_size
+            if self.offset >= len(self.pcm):
+                self.played.set()
+        else:
+            chunk = bytes(self.frame_size)
+
+        data = np.frombuffer(chunk, dtype=np.int16).reshape(1, -1)
+        frame = AudioFrame.from_ndarray(data, format="s16", layout=self.layout)
+        frame.sample_rate = self.sample_rate
+        frame.pts = self._timestamp
+        frame.time_base = Fraction(1, self.sample_rate)
+        return frame
+
+    def stop(self):
+        self.stopped = True
+
+
+class FakeStream:
+    def __init__(self, track: ReplayAudioTrack):
+        self.kind = track.kind
+        self.track = track
+        self.id = track.id
+
+
+class FakeParticipant:
+    def __init__(self, id: str, display_name: str):
+        self.id = id
+        self.display_name = display_name
+        self.listeners: List = []
+
+    def add_event_listener(self, listener):
+        self.listeners.append(listener)
+
+    def enable_stream(self, stream: FakeStream):
+        for listener in self.listeners:
+            listener.on_stream_enabled(stream)
+
+    def disable_stream(self, stream: FakeStream):
+        for listener in self.listeners:
+            listener.on_stream_disabled(stream)
+
+
+class OutboundSink:
+    """Pulls the agent's track like the WebRTC sender, one recv per ptime."""
+
+    def __init__(self, track):
+        self.track = track
+        self.frames = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        try:
+            while True:
+                # recv paces itself at ptime
+                await self.track.recv()
+                self.frames += 1
+        except asyncio.CancelledError:
+            pass
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
@@ -0,0 +1,453 @@
+'''
+Local stand-ins for Deepgram, OpenAI and ElevenLabs, used by the load test.
+
+python -m benchmarks.fake_services serves all three and prints their urls,
+set DEEPGRAM_URL, LLM_BASE_URL and ELEVENLABS_BASE_URL to them to run main.py offline.
+'''
+import asyncio
+import itertools
+import json
+import math
+import time
+import traceback
+from typing import List, Optional
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import websockets
+from agent.control import read_request
+
+
+FAKE_HOST = "127.0.0.1"
+
+# interviewer reply streamed by the llm stub
+FAKE_REPLY = "Thanks, that makes sense. Could you walk me through how you tested it?"
+# what the candidate "said", one per utterance, cycled per connection
+FAKE_TRANSCRIPTS = [
+    "I worked on the payments service for about two years.",
+    "We moved the batch jobs to a queue and added retries.",
+    "Mostly unit tests and a staging environment with replayed traffic.",
+]
+
+# service latencies, roughly what the real apis show from a nearby region
+FAKE_STT_FINAL_MS = 150
+FAKE_LLM_FIRST_TOKEN_MS = 350
+FAKE_LLM_TOKEN_MS = 15
+FAKE_TTS_FIRST_BYTE_MS = 200
+# speech length of the synthesized reply per character of text
+FAKE_TTS_MS_PER_CHAR = 60
+# tts streams this many times faster than real time, in chunks of CHUNK_MS
+FAKE_TTS_SPEEDUP = 4
+FAKE_TTS_CHUNK_MS = 100
+
+# energy gate of the stt stub, same scale as stt.vad
+FAKE_STT_THRESHOLD_DB = -45.0
+# interim results are sent every this much speech, revealing WORDS_PER_SECOND
+FAKE_STT_INTERIM_SECONDS = 0.3
+FAKE_STT_WORDS_PER_SECOND = 2.5
+
+
+def write_head(writer: asyncio.StreamWriter, status: int, content_type: str, length: Optional[int] = None):
+    head = f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\nContent-Type: {content_type}\r\n"
+    if length is None:
+        head += "Transfer-Encoding: chunked\r\n"
+    else:
+        head += f"Content-Length: {length}\r\n"
+    writer.write((head + "Connection: close\r\n\r\n").encode("latin-1"))
+
+
+def write_json(writer: asyncio.StreamWriter, payload, status: int = 200):
+    data = json.dumps(payload).encode("utf-8")
+    write_head(writer, status, "application/json", len(data))
+    writer.write(data)
+
+
+async def write_chunk(writer: asyncio.StreamWriter, data: bytes):
+    writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+    await writer.drain()
+
+
+class StubServer:
+    """Minimal http server, one request per connection like agent.control."""
+
+    def __init__(self, host: str = FAKE_HOST, port: int = 0):
+        self.host = host
+        self.port = port
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.requests = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # the llm stub gets the whole conversation, no body limit
+            method, path, body = await read_request(reader, max_body=None)
+            self.requests += 1
+            await self.respond(method, urlparse(path), body, writer)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # client went away, e.g. an interrupted reply
+            pass
+        except Exception:
+            traceback.print_exc()
+        finally:
+            writer.close()
+
+    async def respond(self, method: str, url, body: dict, writer: asyncio.StreamWriter):
+        write_json(writer, {"error": "not found"}, status=404)
+
+
+class FakeOpenAI(StubServer):
+    """OpenAI compatible chat completions, streamed as server-sent events. Use url + "/v1" as base_url."""
+
+    def __init__(
+        self,
+        reply: str = FAKE_REPLY,
+        first_token_ms: int = FAKE_LLM_FIRST_TOKEN_MS,
+        token_ms: int = FAKE_LLM_TOKEN_MS,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.reply = reply
+        self.first_token_ms = first_token_ms
+        self.token_ms = token_ms
+        # word sized tokens, whitespace kept so the client can join them back
+        self.tokens = [word + " " for word in reply.split()]
+        self.tokens[-1] = self.tokens[-1].rstrip()
+
+    async def respond(self, method, url, body, writer):
+        if method == "GET" and url.path == "/v1/models":
+            write_json(writer, {"object": "list", "data": []})
+            return
+        if method != "POST" or url.path != "/v1/chat/completions":
+            await super().respond(method, url, body, writer)
+            return
+
+        model = body.get("model", "fake")
+        await asyncio.sleep(self.first_token_ms / 1000)
+        if not body.get("stream"):
+            write_json(writer, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.reply},
+                    "finish_reason": "stop",
+                }],
+            })
+            return
+
+        write_head(writer, 200, "text/event-stream")
+        for index, token in enumerate(self.tokens + [None]):
+            if index > 0:
+                await asyncio.sleep(self.token_ms / 1000)
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": token} if token is not None else {},
+                    "finish_reason": None if token is not None else "stop",
+                }],
+            }
+            await write_chunk(writer, f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        await write_chunk(writer, b"data: [DONE]\n\n")
+        await write_chunk(writer, b"")
+
+
+class FakeElevenLabs(StubServer):
+    """ElevenLabs streaming tts, answers with a tone as long as the text would take to say."""
+
+    def __init__(
+        self,
+        first_byte_ms: int = FAKE_TTS_FIRST_BYTE_MS,
+        ms_per_char: int = FAKE_TTS_MS_PER_CHAR,
+        speedup: float = FAKE_TTS_SPEEDUP,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.first_byte_ms = first_byte_ms
+        self.ms_per_char = ms_per_char
+        self.speedup = speedup
+
+    async def respond(self, method, url, body, writer):
+        if method == "GET" and url.path == "/v1/models":
+            write_json(writer, [])
+            return
+        if method != "POST" or not url.path.endswith("/stream"):
+            await super().respond(method, url, body, writer)
+            return
+
+        output_format = parse_qs(url.query).get("output_format", ["pcm_24000"])[0]
+        sample_rate = int(output_format.split("_")[-1])
+        pcm = tone(len(body.get("text", "")) * self.ms_per_char / 1000, sample_rate)
+        chunk_size = int(sample_rate * FAKE_TTS_CHUNK_MS / 1000) * 2
+
+        await asyncio.sleep(self.first_byte_ms / 1000)
+        write_head(writer, 200, "audio/pcm")
+        for offset in range(0, len(pcm), chunk_size):
+            if offset > 0:
+                await asyncio.sleep(FAKE_TTS_CHUNK_MS / 1000 / self.speedup)
+            await write_chunk(writer, pcm[offset:offset + chunk_size])
+        await write_chunk(writer, b"")
+
+
+def tone(seconds: float, sample_rate: int, frequency: float = 220.0, level: float = 0.1) -> bytes:
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return (np.sin(2 * np.pi * frequency * t) * level * 32767).astype(np.int16).tobytes()
+
+
+class FakeSTTConnection:
+    """One scripted deepgram live connection: energy gated speech, interim and final results."""
+
+    def __init__(self, server: "FakeDeepgram", websocket, query: dict):
+        self.server = server
+        self.websocket = websocket
+        self.sample_rate = int(query.get("sample_rate", ["16000"])[0])
+        self.channels = int(query.get("channels", ["1"])[0])
+        self.endpointing = int(query.get("endpointing", ["10"])[0]) / 1000
+
+        self.transcripts = itertools.cycle(server.transcripts)
+        # transcript of the utterance in progress
+        self.current: Optional[str] = None
+        self.offset = 0.0
+        self.speech_start: Optional[float] = None
+        self.speech_end = 0.0
+        self.silence = 0.0
+        self.last_interim = 0.0
+        self.tasks: List[asyncio.Task] = []
+
+    async def run(self):
+        async for message in self.websocket:
+            if isinstance(message, bytes):
+                await self.on_audio(message)
+                continue
+            kind = json.loads(message).get("type")
+            if kind == "Finalize":
+                self.end_speech(from_finalize=True)
+            elif kind == "CloseStream":
+                break
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def on_audio(self, pcm: bytes):
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+        duration = samples.size / self.channels / self.sample_rate
+        start = self.offset
+        self.offset += duration
+        if samples.size == 0:
+            return
+
+        rms = math.sqrt(float(np.mean(samples * samples))) / 32768
+        voiced = rms > 0 and 20 * math.log10(rms) >= FAKE_STT_THRESHOLD_DB
+
+        if voiced:
+            if self.speech_start is None:
+                self.speech_start = start
+                self.last_interim = start
+                await self.send({"type": "SpeechStarted", "channel": [0], "timestamp": start})
+            self.speech_end = self.offset
+            self.silence = 0.0
+            if self.offset - self.last_interim >= FAKE_STT_INTERIM_SECONDS:
+                self.last_interim = self.offset
+                await self.send(self.result(self.peek_transcript(), is_final=False))
+        elif self.speech_start is not None:
+            self.silence += duration
+            if self.silence >= self.endpointing:
+                self.end_speech(from_finalize=False)
+
+    def current_transcript(self) -> str:
+        if self.current is None:
+            self.current = next(self.transcripts)
+        return self.current
+
+    def peek_transcript(self) -> str:
+        # words revealed so far, at a steady speaking rate
+        words = self.current_transcript().split()
+        count = int((self.speech_end - self.speech_start) * FAKE_STT_WORDS_PER_SECOND)
+        return " ".join(words[: max(1, min(count, len(words)))])
+
+    def end_speech(self, from_finalize: bool):
+        if self.speech_start is None:
+            return
+        message = self.result(self.current_transcript(), is_final=True, from_finalize=from_finalize)
+        self.current = None
+        self.speech_start = None
+        self.silence = 0.0
+        self.tasks = [task for task in self.tasks if not task.done()]
+        self.tasks.append(asyncio.create_task(self.send_later(message)))
+
+    async def send_later(self, message: dict):
+        await asyncio.sleep(self.server.final_ms / 1000)
+        await self.send(message)
+
+    async def send(self, message: dict):
+        try:
+            await self.websocket.send(json.dumps(message))
+        except websockets.ConnectionClosed:
+            pass
+
+    def result(self, transcript: str, is_final: bool, from_finalize: bool = False) -> dict:
+        # words spread evenly over the speech
+        words = transcript.split()
+        start, end = self.speech_start, max(self.speech_end, self.speech_start)
+        step = (end - start) / max(len(words), 1)
+        message = {
+            "type": "Results",
+            "channel_index": [0, 1],
+            "duration": end - start,
+            "start": start,
+            "is_final": is_final,
+            "speech_final": is_final and not from_finalize,
+            "channel": {
+                "alternatives": [{
+                    "transcript": transcript,
+                    "confidence": 0.98,
+                    "words": [
+                        {
+                            "word": word.strip(".,!?").lower(),
+                            "start": start + i * step,
+                            "end": start + (i + 1) * step,
+                            "confidence": 0.98,
+                            "punctuated_word": word,
+                        }
+                        for i, word in enumerate(words)
+                    ],
+                }]
+            },
+            "metadata": {
+                "request_id": "fake",
+                "model_info": {"name": "fake", "version": "0", "arch": "fake"},
+                "model_uuid": "fake",
+            },
+        }
+        if from_finalize:
+            message["from_finalize"] = True
+        return message
+
+
+class FakeDeepgram:
+    """Deepgram live transcription over websocket. Pass url as the client's url option."""
+
+    def __init__(
+        self,
+        transcripts: Optional[List[str]] = None,
+        final_ms: int = FAKE_STT_FINAL_MS,
+        host: str = FAKE_HOST,
+        port: int = 0,
+    ):
+        self.transcripts = transcripts or FAKE_TRANSCRIPTS
+        self.final_ms = final_ms
+        self.host = host
+        self.port = port
+        self.server = None
+        self.connections = 0
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}"
+
+    async def start(self):
+        self.server = await websockets.serve(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle(self, websocket):
+        self.connections += 1
+        query = parse_qs(urlparse(websocket.path).query)
+        try:
+            await FakeSTTConnection(self, websocket, query).run()
+        except websockets.ConnectionClosed:
+            pass
+        except Exception:
+            traceback.print_exc()
+
+
+class FakeServices:
+    """All three fakes, started and stopped together."""
+
+    def __init__(self, **options):
+        self.stt = FakeDeepgram(
+            transcripts=options.get("transcripts"),
+            final_ms=options.get("stt_final_ms", FAKE_STT_FINAL_MS),
+        )
+        self.llm = FakeOpenAI(
+            reply=options.get("reply", FAKE_REPLY),
+            first_token_ms=options.get("llm_first_token_ms", FAKE_LLM_FIRST_TOKEN_MS),
+            token_ms=options.get("llm_token_ms", FAKE_LLM_TOKEN_MS),
+        )
+        self.tts = FakeElevenLabs(
+            first_byte_ms=options.get("tts_first_byte_ms", FAKE_TTS_FIRST_BYTE_MS),
+            ms_per_char=options.get("tts_ms_per_char", FAKE_TTS_MS_PER_CHAR),
+        )
+
+    async def start(self):
+        await asyncio.gather(self.stt.start(), self.llm.start(), self.tts.start())
+
+    async def close(self):
+        await asyncio.gather(self.stt.close(), self.llm.close(), self.tts.close())
+
+    def urls(self) -> dict:
+        # host option names, see agent.host.build_host
+        return {
+            "stt_url": self.stt.url,
+            "llm_base_url": self.llm.url + "/v1",
+            "tts_base_url": self.tts.url,
+        }
+
+
+def run_services(conn, options: dict):
+    """Process entry point, sends the urls back over conn and serves until conn is closed."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    services = FakeServices(**options)
+    loop.run_until_complete(services.start())
+    conn.send(services.urls())
+
+    def stop():
+        # the pipe stays readable at eof, stop once
+        loop.remove_reader(conn.fileno())
+        loop.stop()
+
+    loop.add_reader(conn.fileno(), stop)
+    try:
+        loop.run_forever()
+    finally:
+        loop.run_until_complete(services.close())
+        loop.close()
+
+
+async def serve():
+    services = FakeServices()
+    await services.start()
+    urls = services.urls()
+    print(f"DEEPGRAM_URL={urls['stt_url']}")
+    print(f"LLM_BASE_URL={urls['llm_base_url']}")
+    print(f"ELEVENLABS_BASE_URL={urls['tts_base_url']}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,268 @@
+'''
+Offline load test: N interviewer sessions on one AgentHost against local fakes.
+
+    python -m benchmarks.load_test --sessions 20 --turns 5 --json report.json
+
+Each session is a real AgentSession (DeepgramSTT, OpenAIIntelligence,
+ElevenLabsTTS, CustomAudioStreamTrack) whose meeting is played by a fake
+participant: its audio stream replays wav files or synthetic speech and it
+waits for each reply before speaking again. The fake services run in their
+own process so cpu and memory are the agent's only.
+'''
+import argparse
+import asyncio
+from contextlib import redirect_stdout
+import json
+import multiprocessing
+import os
+import resource
+import time
+from typing import List, Optional
+from agent.agent import MyMeetingEventListener
+from agent.host import AgentHost, AgentSession, build_host
+from agent.tracing import percentiles
+from benchmarks.fake_meeting import (
+    FakeParticipant,
+    FakeStream,
+    OutboundSink,
+    ReplayAudioTrack,
+    Utterance,
+    load_wav,
+    synthetic_utterance,
+)
+from benchmarks.fake_services import (
+    FAKE_LLM_FIRST_TOKEN_MS,
+    FAKE_STT_FINAL_MS,
+    FAKE_TTS_FIRST_BYTE_MS,
+    run_services,
+)
+
+
+# a reply not finished within this long counts as a timeout
+LOAD_REPLY_TIMEOUT = 20.0
+# an utterance not read by the agent within its length plus this long means its ingest died
+LOAD_INGEST_TIMEOUT = 5.0
+# pause between the end of a reply and the next utterance
+LOAD_THINK_MS = 500
+LOAD_UTTERANCE_SECONDS = (2.5, 3.0, 2.0)
+# event loop lag is sampled this often
+LOOP_LAG_INTERVAL = 0.01
+
+
+class FakeMeeting:
+    """Stands in for the joined meeting, leaving does nothing."""
+
+    def leave(self):
+        pass
+
+
+class CandidateSession:
+    """One room: an AgentSession and a fake candidate that speaks and waits for each reply."""
+
+    def __init__(self, host: AgentHost, index: int, utterances: List[Utterance]):
+        self.utterances = utterances
+        self.session = AgentSession(host=host, room_id=f"load-{index}")
+        self.session.interviewer.meeting = FakeMeeting()
+
+        self.participant = FakeParticipant(id=f"candidate-{index}", display_name=f"Candidate {index}")
+        self.track = ReplayAudioTrack(
+            sample_rate=utterances[0].sample_rate, channels=utterances[0].channels
+        )
+        self.stream = FakeStream(self.track)
+        self.sink = OutboundSink(self.session.audio_track)
+
+        self.replied = asyncio.Event()
+        self.session.audio_track.add_speaking_listener(self.on_speaking)
+        self.timeouts = 0
+        # the agent stopped reading the candidate's audio, the remaining turns are skipped
+        self.failed = False
+
+    def on_speaking(self, speaking: bool):
+        if not speaking:
+            self.replied.set()
+
+    async def start(self):
+        await self.session.stt.prewarm()
+        # what the meeting listener sees when the candidate joins and unmutes
+        listener = MyMeetingEventListener(stt=self.session.stt)
+        listener.on_participant_joined(self.participant)
+        self.participant.enable_stream(self.stream)
+        self.sink.start()
+
+    async def run(self, turns: int, think_seconds: float):
+        for turn in range(turns):
+            self.replied.clear()
+            utterance = self.utterances[turn % len(self.utterances)]
+            try:
+                await self.track.say(utterance, timeout=utterance.seconds + LOAD_INGEST_TIMEOUT)
+            except asyncio.TimeoutError:
+                print(f"{self.participant.display_name}: audio not read after {turn} turns, session failed")
+                self.failed = True
+                return
+            try:
+                await asyncio.wait_for(self.replied.wait(), LOAD_REPLY_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+            await asyncio.sleep(think_seconds)
+
+    async def stop(self):
+        self.participant.disable_stream(self.stream)
+        self.track.stop()
+        self.sink.stop()
+        await self.session.stop()
+
+
+class LoopLagProbe:
+    """How late the event loop wakes a short sleep, a proxy for audio timing jitter."""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.lags: List[float] = []
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        while True:
+            started_at = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.lags.append((time.monotonic() - started_at - self.interval) * 1000)
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    def summary(self) -> dict:
+        if not self.lags:
+            return {}
+        return {**percentiles(self.lags, digits=2), "max": round(max(self.lags), 2)}
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run_load(args) -> dict:
+    loop = asyncio.get_running_loop()
+
+    # fakes in their own process, the numbers below are the agent's only
+    context = multiprocessing.get_context("spawn")
+    conn, child_conn = context.Pipe()
+    services = context.Process(
+        target=run_services,
+        args=(child_conn, {
+            "transcripts": args.transcript or None,
+            "stt_final_ms": args.stt_final_ms,
+            "llm_first_token_ms": args.llm_first_token_ms,
+            "tts_first_byte_ms": args.tts_first_byte_ms,
+        }),
+        daemon=True,
+    )
+    services.start()
+    child_conn.close()
+    urls = await loop.run_in_executor(None, conn.recv)
+
+    if args.wav:
+        utterances = [load_wav(path) for path in args.wav]
+    else:
+        utterances = [synthetic_utterance(seconds) for seconds in LOAD_UTTERANCE_SECONDS]
+
+    host = build_host(loop, {
+        "stt_api_key": "fake",
+        "tts_api_key": "fake",
+        "llm_api_key": "fake",
+        "filler_phrases": [],
+        "trace_file": args.trace_file,
+        **urls,
+    })
+    await host.prewarm()
+
+    rss_before = rss_mb()
+    sessions = [CandidateSession(host, index, utterances) for index in range(args.sessions)]
+    await asyncio.gather(*[session.start() for session in sessions])
+    rss_started = rss_mb()
+
+    probe = LoopLagProbe()
+    probe.start()
+    cpu_started_at = time.process_time()
+    started_at = time.monotonic()
+    try:
+        await asyncio.gather(
+            *[session.run(args.turns, args.think_ms / 1000) for session in sessions]
+        )
+    finally:
+        duration = time.monotonic() - started_at
+        cpu = time.process_time() - cpu_started_at
+        probe.stop()
+        rss_after = rss_mb()
+        # before the tracks stop and leave the clock
+        media_clock = host.media_clock.stats()
+
+        await asyncio.gather(*[session.stop() for session in sessions])
+        await host.close()
+        conn.close()
+        services.join(5)
+
+    return {
+        "sessions": args.sessions,
+        "turns_per_session": args.turns,
+        "duration_s": round(duration, 2),
+        "cpu_s": round(cpu, 2),
+        # share of one core used by the agent process
+        "cpu_percent": round(100 * cpu / duration, 1),
+        "cpu_ms_per_session_second": round(1000 * cpu / duration / max(args.sessions, 1), 2),
+        "rss_mb": round(rss_after, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "rss_per_session_mb": round((rss_started - rss_before) / max(args.sessions, 1), 2),
+        "loop_lag_ms": probe.summary(),
+        "frames_sent": sum(session.sink.frames for session in sessions),
+        "reply_timeouts": sum(session.timeouts for session in sessions),
+        "failed_sessions": sum(session.failed for session in sessions),
+        "latency_ms": host.latency_stats.summary(),
+        "media_clock": media_clock,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=1)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--think-ms", type=int, default=LOAD_THINK_MS)
+    parser.add_argument("--wav", action="append", help="16 bit wav replayed as the candidate, repeatable")
+    parser.add_argument("--transcript", action="append", help="what the fake stt returns per utterance, repeatable")
+    parser.add_argument("--stt-final-ms", type=int, default=FAKE_STT_FINAL_MS)
+    parser.add_argument("--llm-first-token-ms", type=int, default=FAKE_LLM_FIRST_TOKEN_MS)
+    parser.add_argument("--tts-first-byte-ms", type=int, default=FAKE_TTS_FIRST_BYTE_MS)
+    parser.add_argument("--trace-file", help="per-turn json lines, see agent.tracing")
+    parser.add_argument("--json", help="write the report here as well")
+    parser.add_argument("--verbose", action="store_true", help="keep the agent's own output")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.verbose:
+        report = asyncio.run(run_load(args))
+    else:
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            report = asyncio.run(run_load(args))
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.json:
+        with open(args.json, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+'''
+Microbenchmarks of the per-frame audio paths.
+
+    python -m benchmarks.microbench                      # compare with benchmarks/baseline.json if present
+    python -m benchmarks.microbench --save-baseline      # record this machine's baseline
+    python -m benchmarks.microbench --only recv_speech --frames 20000
+
+Reports ns/frame (median of the repeats), python heap bytes allocated per
+frame (tracemalloc, buffers allocated inside libav are not seen), blocks
+left allocated per frame (anything above 0 is growth) and frames/sec on one
+core. A benchmark more than --threshold slower than its baseline fails the
+run with exit code 1. Baselines are per machine, record one on the machine
+that runs the comparison.
+'''
+from abc import ABC, abstractmethod
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+from av import AudioFrame
+import numpy as np
+from agent.audio_stream_track import (
+    AudioFramePool,
+    CustomAudioStreamTrack,
+    AUDIO_FRAME_POOL_SIZE,
+    build_audio_frame,
+)
+from agent.media_clock import MediaClock
+from stt.audio_ingest import AudioIngest
+
+
+BENCH_FRAMES = 5000
+BENCH_REPEATS = 5
+BENCH_ALLOC_FRAMES = 200
+# slower than the baseline by more than this fraction is a regression
+BENCH_THRESHOLD = 0.25
+BENCH_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# one outbound frame: 20 ms of 24 kHz mono s16
+OUT_SAMPLE_RATE = 24000
+OUT_CHUNK = int(0.02 * OUT_SAMPLE_RATE) * 2
+# a typical streamed tts chunk, not a multiple of the frame size
+TTS_CHUNK = 4410
+# inbound webrtc audio: 20 ms of 48 kHz stereo s16
+IN_SAMPLE_RATE = 48000
+IN_SAMPLES = int(0.02 * IN_SAMPLE_RATE)
+
+
+def speech_pcm(size: int) -> bytes:
+    rng = np.random.default_rng(0)
+    return rng.integers(-8000, 8000, size // 2, dtype=np.int16).tobytes()
+
+
+def inbound_frame(sample_rate: int, channels: int) -> AudioFrame:
+    samples = int(0.02 * sample_rate)
+    data = np.frombuffer(speech_pcm(samples * channels * 2), dtype=np.int16).reshape(1, -1)
+    frame = AudioFrame.from_ndarray(data, format="s16", layout="mono" if channels == 1 else "stereo")
+    frame.sample_rate = sample_rate
+    return frame
+
+
+class Bench(ABC):
+    """One hot path. step() handles `frames` audio frames."""
+
+    name = ""
+    frames = 1
+
+    def setup(self, loop: asyncio.AbstractEventLoop):
+        pass
+
+    @abstractmethod
+    async def step(self):
+        """Run the hot path once."""
+        pass
+
+    def teardown(self):
+        pass
+
+
+class BuildAudioFrame(Bench):
+    """bytes to av.AudioFrame, what recv did for every frame before the frame pool."""
+
+    name = "build_audio_frame"
+
+    def setup(self, loop):
+        self.chunk = speech_pcm(OUT_CHUNK)
+
+    async def step(self):
+        build_audio_frame(self.chunk)
+
+
+class FramePoolAcquire(Bench):
+    name = "frame_pool_acquire"
+
+    def setup(self, loop):
+        self.chunk = speech_pcm(OUT_CHUNK)
+        self.pool = AudioFramePool(
+            size=AUDIO_FRAME_POOL_SIZE, samples=OUT_CHUNK // 2, sample_rate=OUT_SAMPLE_RATE
+        )
+
+    async def step(self):
+        self.pool.acquire(self.chunk)
+
+
+class FreeRunningPacer:
+    """Stands in for the track's MediaPacer, every frame is due right away."""
+
+    async def next_frame(self, produce):
+        return produce(0)
+
+    def close(self):
+        pass
+
+
+class TrackBench(Bench):
+    """Runs against a real CustomAudioStreamTrack, recv is not paced."""
+
+    def setup(self, loop):
+        self.track = CustomAudioStreamTrack(loop=loop)
+        self.track.pacer = FreeRunningPacer()
+
+    def teardown(self):
+        self.track._process_audio_task.cancel()
+
+
+class ChunkingLoop(Bench):
+    """Producer side of a reply: tts chunks split into the ring buffer by write_audio_data."""
+
+    name = "chunking_loop"
+    frames = TTS_CHUNK / OUT_CHUNK
+
+    def setup(self, loop):
+        self.track = CustomAudioStreamTrack(loop=loop)
+        self.chunk = speech_pcm(TTS_CHUNK)
+
+    async def step(self):
+        ring = self.track.ring_buffer
+        await self.track.write_audio_data(self.chunk)
+        # drain whole frames as recv would, the watermark is never reached
+        ring.consume(ring.available - ring.available % OUT_CHUNK)
+
+    def teardown(self):
+        self.track._process_audio_task.cancel()
+
+
+class RecvSilence(TrackBench):
+    name = "recv_silence"
+
+    async def step(self):
+        await self.track.recv()
+
+
+class RecvSpeech(TrackBench):
+    """recv with audio buffered, the ring is refilled every REFILL frames (amortized in the result)."""
+
+    name = "recv_speech"
+    REFILL = 200
+
+    def setup(self, loop):
+        super().setup(loop)
+        self.refill = speech_pcm(OUT_CHUNK * self.REFILL)
+
+    async def step(self):
+        if self.track.ring_buffer.available < OUT_CHUNK:
+            self.track.ring_buffer.write(self.refill)
+        await self.track.recv()
+
+
+class ClockBatch(Bench):
+    """One tick of the shared media clock building the frames of BATCH silent tracks.
+
+    The clock's stat windows fill up over the first MEDIA_CLOCK_WINDOW ticks,
+    retained blocks only settle at 0 with --frames well above BATCH * 500.
+    """
+
+    name = "clock_batch"
+    BATCH = 100
+    frames = BATCH
+
+    def setup(self, loop):
+        self.loop = loop
+        self.clock = MediaClock(loop=loop)
+        self.tracks = [CustomAudioStreamTrack(loop=loop, clock=self.clock) for _ in range(self.BATCH)]
+        for track in self.tracks:
+            # as if each track had already sent its first frame
+            track.pacer.start_tick = 0
+
+    async def step(self):
+        # what park() leaves in the wheel slot of a tick
+        self.clock.run_batch(
+            [(track.pacer, track.build_frame, self.loop.create_future()) for track in self.tracks]
+        )
+
+    def teardown(self):
+        for track in self.tracks:
+            track._process_audio_task.cancel()
+
+
+class IngestResample(Bench):
+    """Inbound 48 kHz stereo frame to 16 kHz mono linear16, AudioIngest.convert."""
+
+    name = "ingest_resample"
+
+    def setup(self, loop):
+        self.ingest = AudioIngest()
+        self.frame = inbound_frame(IN_SAMPLE_RATE, 2)
+
+    async def step(self):
+        self.frame.pts = None
+        self.ingest.convert(self.frame)
+
+
+class IngestPassthrough(Bench):
+    """Inbound frame already in the stt format, copied out without resampling."""
+
+    name = "ingest_passthrough"
+
+    def setup(self, loop):
+        self.ingest = AudioIngest()
+        self.frame = inbound_frame(self.ingest.sample_rate, self.ingest.channels)
+
+    async def step(self):
+        self.ingest.convert(self.frame)
+
+
+class IngestNdarray(Bench):
+    """The former to_ndarray -> astype -> tobytes conversion (no resampling), kept as a reference."""
+
+    name = "ingest_ndarray"
+
+    def setup(self, loop):
+        self.frame = inbound_frame(IN_SAMPLE_RATE, 2)
+
+    async def step(self):
+        self.frame.to_ndarray().flatten().astype(np.int16).tobytes()
+
+
+BENCHMARKS = [
+    BuildAudioFrame,
+    FramePoolAcquire,
+    ChunkingLoop,
+    RecvSilence,
+    RecvSpeech,
+    ClockBatch,
+    IngestResample,
+    IngestPassthrough,
+    IngestNdarray,
+]
+
+
+async def timed(bench: Bench, steps: int) -> int:
+    started_at = time.perf_counter_ns()
+    for _ in range(steps):
+        await bench.step()
+    return time.perf_counter_ns() - started_at
+
+
+async def allocated(bench: Bench, steps: int) -> float:
+    # peak python heap above the start of each step, i.e. what the step allocates
+    tracemalloc.start()
+    try:
+        total = 0
+        for _ in range(steps):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            await bench.step()
+            total += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return total / steps
+
+
+def run_bench(cls, frames: int, repeats: int) -> dict:
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    bench = cls()
+    try:
+        bench.setup(loop)
+        steps = max(1, int(frames / bench.frames))
+
+        # warm up caches and lazily created state (resampler, pools)
+        loop.run_until_complete(timed(bench, min(steps, 500)))
+
+        blocks = sys.getallocatedblocks()
+        samples = [loop.run_until_complete(timed(bench, steps)) / (steps * bench.frames) for _ in range(repeats)]
+        retained = (sys.getallocatedblocks() - blocks) / (steps * repeats * bench.frames)
+
+        alloc_steps = max(1, int(BENCH_ALLOC_FRAMES / bench.frames))
+        alloc_bytes = loop.run_until_complete(allocated(bench, alloc_steps)) / bench.frames
+    finally:
+        bench.teardown()
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
+
+    ns = statistics.median(samples)
+    return {
+        "ns_per_frame": round(ns, 1),
+        "min_ns_per_frame": round(min(samples), 1),
+        "alloc_bytes_per_frame": round(alloc_bytes, 1),
+        "retained_blocks_per_frame": round(retained, 3),
+        "frames_per_sec_core": int(1e9 / ns) if ns > 0 else None,
+        # 20 ms streams one core could serve on this path alone
+        "streams_per_core": int(1e9 / ns / 50) if ns > 0 else None,
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        change = result["ns_per_frame"] / reference["ns_per_frame"] - 1
+        result["vs_baseline"] = f"{change:+.1%}"
+        if change > threshold:
+            regressions.append(
+                f"{name}: {result['ns_per_frame']} ns/frame, baseline {reference['ns_per_frame']} ({change:+.1%})"
+            )
+    return regressions
+
+
+def load_baseline(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f).get("benchmarks", {})
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=BENCH_FRAMES, help="frames per repeat")
+    parser.add_argument("--repeats", type=int, default=BENCH_REPEATS)
+    parser.add_argument("--only", action="append", help="benchmark name, repeatable")
+    parser.add_argument("--baseline", default=BENCH_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=BENCH_THRESHOLD)
+    parser.add_argument("--json", help="write the results here as well")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    selected = [cls for cls in BENCHMARKS if not args.only or cls.name in args.only]
+
+    results = {}
+    for cls in selected:
+        results[cls.name] = run_bench(cls, args.frames, args.repeats)
+        result = results[cls.name]
+        print(
+            f"{cls.name:22} {result['ns_per_frame']:>10.1f} ns/frame"
+            f" {result['alloc_bytes_per_frame']:>8.1f} B/frame"
+            f" {result['retained_blocks_per_frame']:>7.3f} blocks/frame"
+            f" {result['frames_per_sec_core']:>10} frames/s/core"
+        )
+
+    report = {"python": sys.version.split()[0], "benchmarks": results}
+
+    regressions = []
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Baseline written to", args.baseline)
+    else:
+        baseline = load_baseline(args.baseline)
+        if baseline is not None:
+            regressions = compare(results, baseline, args.threshold)
+            for name, result in results.items():
+                if "vs_baseline" in result:
+                    print(f"{name:22} {result['vs_baseline']:>8} vs baseline")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    for regression in regressions:
+        print("REGRESSION", regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
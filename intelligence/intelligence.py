@@ -8,7 +8,26 @@ class Intelligence(ABC):
         pass
 
     @abstractmethod
-    def generate(self, text: str, sender_name: str):
+    async def generate(self, text: str, sender_name: str):
         """generate new message based on text."""
         pass
 
+    def speculate(self, text: str, sender_name: str):
+        """start generating on an interim transcript, reused by generate if the final text matches."""
+        pass
+
+    async def prewarm(self):
+        """Open and pool connections before the first turn."""
+        pass
+
+    def speaking(self) -> bool:
+        """Whether reply audio (not a filler) is being played."""
+        return False
+
+    def interrupt(self):
+        """Barge-in, stop the reply being generated or played."""
+        pass
+
+    def close(self):
+        """Release background tasks when the session ends."""
+        pass
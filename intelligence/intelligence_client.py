@@ -1,8 +1,33 @@
-from typing import Optional
-from openai import OpenAI, Stream
+from contextlib import aclosing
+import time
+from typing import AsyncIterator, Dict, List, Optional
+from openai import AsyncOpenAI, AsyncStream, DefaultAsyncHttpxClient
 from openai.types.chat import ChatCompletionChunk
 from tts.tts import TTS
+from agent.http_pool import pooled_limits
+from agent.tracing import TurnTracer
 from intelligence.intelligence import Intelligence
+from intelligence.memory import ConversationMemory, TokenCounter, MEMORY_TOKEN_BUDGET
+from intelligence.retrieval import ContextRetriever
+from intelligence.speculation import SpeculativeResponse
+
+
+# phrase is flushed to tts on sentence end, or on clause end once it is long enough
+SENTENCE_BOUNDARIES = ".!?"
+CLAUSE_BOUNDARIES = ",;:"
+MIN_CLAUSE_LENGTH = 30
+
+SUMMARY_PROMPT = "Update the summary of this interview with the new messages. Keep the candidate's answers, the topics covered and any open questions. Reply with the summary only."
+SUMMARY_MAX_TOKENS = 300
+
+
+def create_openai_client(api_key: str, base_url: Optional[str] = "https://api.openai.com/v1") -> AsyncOpenAI:
+    return AsyncOpenAI(
+        base_url=base_url,
+        api_key=api_key,
+        max_retries=3,
+        http_client=DefaultAsyncHttpxClient(limits=pooled_limits()),
+    )
 
 
 class OpenAIIntelligence(Intelligence):
@@ -12,26 +37,64 @@ class OpenAIIntelligence(Intelligence):
         tts: TTS,
         base_url: Optional[str] = "https://api.openai.com/v1",
         model: Optional[str] = None,
+        stream: Optional[bool] = True,
+        token_budget: int = MEMORY_TOKEN_BUDGET,
+        retriever: Optional[ContextRetriever] = None,
+        openai_client: Optional[AsyncOpenAI] = None,
+        tracer: Optional[TurnTracer] = None,
     ):
-        self.client = OpenAI(
-            base_url=base_url,
-            api_key=api_key,
-            max_retries=3,
-        ).chat
+        self.openai_client = openai_client or create_openai_client(api_key, base_url)
+        self.client = self.openai_client.chat
 
         self.tts = tts
         self.system_prompt = "You are AI Interviewer and you are interviewing a candidate for a software engineering position."
-        self.chat_history = []
         self.model = model or "gpt-3.5-turbo"
+        self.stream = stream
+
+        # history is trimmed to token_budget per prompt, older turns are summarized
+        self.memory = ConversationMemory(
+            summarize=self.summarize,
+            counter=TokenCounter(self.model),
+            token_budget=token_budget,
+        )
+
+        # local lookup into job description, question bank and resume
+        self.retriever = retriever
+
+        # set on barge-in to what the candidate heard of the reply being recorded
+        self.heard_text: Optional[str] = None
+        self.recording = False
+        # latest reply in history, trimmed if it is interrupted after it was generated
+        self.last_response: Optional[dict] = None
+
+        # response generated ahead of the final transcript
+        self.speculation: Optional[SpeculativeResponse] = None
+
+        self.tracer = tracer
+
+    async def prewarm(self):
+        # a cheap request opens the pooled connection and completes the tls handshake
+        try:
+            await self.openai_client.models.list()
+        except Exception as e:
+            print("Error while prewarming LLM connection", e)
 
     def build_messages(
         self,
         text: str,
         sender_name: str,
+        commit: bool = True,
     ):
-        # TODO: generate context related to text
-        # RAG
-        context = ""
+        # RAG, context related to text goes into the system message
+        system_prompt = self.system_prompt
+        if self.retriever is not None:
+            try:
+                context = self.retriever.retrieve(text)
+            except Exception as e:
+                print("Error while retrieving context", e)
+                context = ""
+            if context:
+                system_prompt = f"{system_prompt}\n\nRelevant context:\n{context}"
 
         # Build the message
         human_message = {
@@ -41,26 +104,12 @@ class OpenAIIntelligence(Intelligence):
             "content": text,
         }
 
-        # Add message to history
-        self.chat_history.append(human_message)
-
-        # Local chat history limited to few messages
-        chat_history = []
-
-        # Add system message and generated context
-        chat_history.append(
-            {
-                "role": "system",
-                "type": "system",
-                "content": self.system_prompt,
-            }
-        )
-
-        # Add few messages from global history
-        chat_history = chat_history + self.chat_history[-20:]
+        # Add message to history, speculative requests leave the history untouched
+        if commit:
+            self.memory.add(human_message)
+            return self.memory.build(system_prompt)
 
-        # Return local chat history
-        return chat_history
+        return self.memory.build(system_prompt, pending=human_message)
 
     def add_response(self, text):
         ai_message = {
@@ -70,37 +119,201 @@ class OpenAIIntelligence(Intelligence):
             "content": text,
         }
 
-        self.chat_history.append(ai_message)
+        self.memory.add(ai_message)
+        return ai_message
+
+    async def summarize(self, summary: str, messages: List[dict]) -> str:
+        transcript = "\n".join(
+            f"{message.get('name', message['role'])}: {message['content']}"
+            for message in messages
+        )
+        response = await self.client.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {
+                    "role": "user",
+                    "content": f"Summary so far:\n{summary or '(none)'}\n\nNew messages:\n{transcript}",
+                },
+            ],
+            max_tokens=SUMMARY_MAX_TOKENS,
+            temperature=0,
+        )
+        return response.choices[0].message.content or summary
 
-    def text_generator(self, response: Stream[ChatCompletionChunk]):
-        for chunk in response:
+    async def text_generator(
+        self, response: AsyncStream[ChatCompletionChunk], marks: Optional[Dict[str, float]] = None
+    ):
+        async for chunk in response:
+            if not chunk.choices:
+                continue
             content = chunk.choices[0].delta.content
             if content:
+                if marks is not None and "llm_first_token" not in marks:
+                    marks["llm_first_token"] = time.monotonic()
                 yield content
 
-    def generate(self, text: str, sender_name: str):
-        # build old history
-        messages = self.build_messages(text, sender_name=sender_name)
+    def find_phrase_boundary(self, text: str) -> int:
+        # boundary only counts once it is followed by whitespace, so "3.5" or "e.g." mid-token are kept
+        for i in range(len(text) - 2, -1, -1):
+            if not text[i + 1].isspace():
+                continue
+            if text[i] in SENTENCE_BOUNDARIES:
+                return i + 1
+            if text[i] in CLAUSE_BOUNDARIES and i + 1 >= MIN_CLAUSE_LENGTH:
+                return i + 1
+        return 0
+
+    async def phrase_generator(self, tokens: AsyncIterator[str]):
+        phrase = ""
+        async for token in tokens:
+            phrase += token
+            boundary = self.find_phrase_boundary(phrase)
+            if boundary > 0:
+                text = phrase[:boundary].strip()
+                phrase = phrase[boundary:]
+                if text:
+                    yield text
+
+        if phrase.strip():
+            yield phrase.strip()
 
-        # generate llm completion
-        response = self.client.completions.create(
+    async def create_completion(self, messages, stream: bool):
+        return await self.client.completions.create(
             model=self.model,
             messages=messages,
             max_tokens=100,
             temperature=0.5,
-            stream=False,
+            stream=stream,
         )
+
+    async def response_generator(self, messages, marks: Optional[Dict[str, float]] = None):
+        # marks gets the llm_request and llm_first_token timestamps of this response
+        if marks is not None:
+            marks["llm_request"] = time.monotonic()
+        response = await self.create_completion(messages, stream=True)
+        try:
+            async for phrase in self.phrase_generator(self.text_generator(response, marks)):
+                yield phrase
+        finally:
+            await response.close()
+
+    async def record_response(self, phrases: AsyncIterator[str]):
         response_text = ""
+        self.heard_text = None
+        self.recording = True
+        self.last_response = None
+        try:
+            async with aclosing(phrases):
+                async for phrase in phrases:
+                    response_text = f"{response_text} {phrase}".strip()
+                    yield phrase
+        finally:
+            if self.heard_text is not None:
+                # interrupted, history only keeps what was actually heard
+                print(f"[Interviewer] (interrupted, generated): {response_text}")
+                response_text = self.heard_text
+                self.heard_text = None
+            self.recording = False
+            print(f"[Interviewer]: {response_text}")
+
+            # add response to history
+            if response_text:
+                self.last_response = self.add_response(response_text)
+
+    def interrupt(self):
+        heard = self.tts.interrupt()
+        if heard is None:
+            # nothing was being played
+            return
+        print("Interviewer interrupted")
+        if self.recording:
+            self.heard_text = heard
+        elif self.last_response is not None:
+            # generated completely but still playing
+            print(f"[Interviewer] (heard): {heard}")
+            self.memory.replace(self.last_response, heard)
+            self.last_response = None
+
+    def speaking(self) -> bool:
+        return self.tts.speaking()
+
+    def mark(self, stage: str):
+        if self.tracer is not None:
+            self.tracer.mark(stage)
+
+    def close(self):
+        self.cancel_speculation()
+        self.memory.close()
+
+    def speculate(self, text: str, sender_name: str):
+        if not self.stream:
+            return
+        if self.speculation is not None and self.speculation.matches(text, sender_name):
+            return
+
+        self.cancel_speculation()
+        messages = self.build_messages(text, sender_name=sender_name, commit=False)
+        marks = {}
+        self.speculation = SpeculativeResponse(
+            text=text,
+            sender_name=sender_name,
+            phrases=self.response_generator(messages, marks),
+            marks=marks,
+        )
+
+    def cancel_speculation(self):
+        if self.speculation is not None:
+            self.speculation.cancel()
+            self.speculation = None
+
+    def take_speculation(self, text: str, sender_name: str) -> Optional[SpeculativeResponse]:
+        speculation = self.speculation
+        self.speculation = None
+        if speculation is None:
+            return None
+        if speculation.usable and speculation.matches(text, sender_name):
+            return speculation
+        speculation.cancel()
+        return None
+
+    async def generate(self, text: str, sender_name: str):
+        speculation = self.take_speculation(text, sender_name)
+
+        if not self.stream:
+            # build old history
+            messages = self.build_messages(text, sender_name=sender_name)
+
+            # generate llm completion as a block
+            self.mark("llm_request")
+            response = await self.create_completion(messages, stream=False)
+            self.mark("llm_first_token")
+            response_text = response.choices[0].message.content
+            await self.tts.generate(text=response_text)
+
+            print(f"[Interviewer]: {response_text}")
 
-        # TODO: handle stream response and generate text chunk by chunk
-        # text_iterator = self.text_generator(response)
-        # self.tts.generate(text=text_iterator)
+            # add response to history, trimmed by interrupt() if it is cut off while playing
+            self.last_response = self.add_response(response_text)
+            return
 
-        # generate text as a block
-        response_text = response.choices[0].message.content
-        self.tts.generate(text=response_text)
+        if speculation is not None:
+            # interim transcript matched the final one, reuse what is already generated
+            print("Using speculative response")
+            self.build_messages(text, sender_name=sender_name)
+            phrases = speculation.replay()
+            marks = speculation.marks
+        else:
+            # build old history
+            messages = self.build_messages(text, sender_name=sender_name)
+            marks = {}
+            phrases = self.response_generator(messages, marks)
 
-        print(f"[Interviewer]: {response_text}")
+        if self.tracer is not None:
+            self.tracer.link(marks)
 
-        # add response to history
-        self.add_response(response_text)
+        # phrases are synthesized one by one as soon as llm completes them
+        job = await self.tts.generate(text=self.record_response(phrases))
+        if speculation is not None:
+            # a job cancelled before it starts never iterates replay(), stop the llm stream too
+            job.add_cancel_callback(speculation.cancel)
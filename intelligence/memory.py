@@ -0,0 +1,195 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, List, Optional
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+# history tokens sent with each prompt, on top of the system prompt
+MEMORY_TOKEN_BUDGET = 2000
+# older turns are folded into the summary once the raw history grows past this
+MEMORY_SUMMARY_TRIGGER = 3000
+# tokens of recent turns kept verbatim when folding
+MEMORY_KEEP_RECENT = 1000
+# if summarizing keeps failing, history past this is dropped anyway
+MEMORY_HARD_LIMIT = 12000
+# a failed summary is retried after this many seconds, doubling per failure
+MEMORY_RETRY_DELAY = 5.0
+# consecutive failed summaries before folding is given up, the hard limit still applies
+MEMORY_MAX_ATTEMPTS = 5
+# role, name and separators per chat message
+MESSAGE_TOKEN_OVERHEAD = 4
+
+
+class TokenCounter:
+    """tiktoken when it is installed, otherwise roughly four characters per token."""
+
+    def __init__(self, model: Optional[str] = None):
+        self.encoding = None
+        if tiktoken is None:
+            return
+        try:
+            self.encoding = tiktoken.encoding_for_model(model or "")
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        return len(text) // 4 + 1
+
+    def count_message(self, message: dict) -> int:
+        return self.count(message.get("content") or "") + MESSAGE_TOKEN_OVERHEAD
+
+
+class ConversationMemory:
+    """Chat history with token counts kept per message and a rolling summary.
+
+    Token counts are computed once when a message is added. When the raw
+    history grows past summary_trigger, the oldest turns are folded into the
+    summary by a background task; they stay in the history until the new
+    summary is ready, so prompts are never missing context in between. A
+    failed summary is retried with a growing delay when the next message
+    arrives, meanwhile the oldest messages past hard_limit are dropped.
+    """
+
+    def __init__(
+        self,
+        summarize: Callable[[str, List[dict]], Awaitable[str]],
+        counter: TokenCounter,
+        token_budget: int = MEMORY_TOKEN_BUDGET,
+        summary_trigger: int = MEMORY_SUMMARY_TRIGGER,
+        keep_recent: int = MEMORY_KEEP_RECENT,
+        hard_limit: int = MEMORY_HARD_LIMIT,
+    ):
+        self.summarize = summarize
+        self.counter = counter
+        self.token_budget = token_budget
+        self.summary_trigger = summary_trigger
+        self.keep_recent = keep_recent
+        self.hard_limit = hard_limit
+
+        self.messages: Deque[dict] = deque()
+        self.message_tokens: Deque[int] = deque()
+        self.tokens = 0
+
+        self.summary = ""
+        self.summary_tokens = 0
+        self.summary_task: Optional[asyncio.Task] = None
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def add(self, message: dict):
+        tokens = self.counter.count_message(message)
+        self.messages.append(message)
+        self.message_tokens.append(tokens)
+        self.tokens += tokens
+        self.maybe_summarize()
+
+    def replace(self, message: dict, content: str):
+        """Change the content of a stored message, an empty content removes it."""
+        for index in range(len(self.messages) - 1, -1, -1):
+            if self.messages[index] is not message:
+                continue
+            self.tokens -= self.message_tokens[index]
+            if not content:
+                del self.messages[index]
+                del self.message_tokens[index]
+                return
+            message["content"] = content
+            self.message_tokens[index] = self.counter.count_message(message)
+            self.tokens += self.message_tokens[index]
+            return
+
+    def build(self, system_prompt: str, pending: Optional[dict] = None) -> List[dict]:
+        """Prompt messages: system prompt with the summary, then the newest turns that fit the budget.
+
+        pending is appended last without being stored, used for speculative requests.
+        """
+        budget = self.token_budget - self.summary_tokens
+        tail = [pending] if pending is not None else []
+        if pending is not None:
+            budget -= self.counter.count_message(pending)
+
+        # walk back from the newest message, the latest one is always sent
+        count = 0
+        for tokens in reversed(self.message_tokens):
+            if count > 0 and tokens > budget:
+                break
+            budget -= tokens
+            count += 1
+            if budget <= 0:
+                break
+
+        system_content = system_prompt
+        if self.summary:
+            system_content = f"{system_prompt}\n\nSummary of the conversation so far:\n{self.summary}"
+
+        messages = [{"role": "system", "type": "system", "content": system_content}]
+        if count > 0:
+            messages.extend(list(self.messages)[-count:])
+        return messages + tail
+
+    def maybe_summarize(self):
+        if self.summary_task is not None and not self.summary_task.done():
+            return
+        if self.tokens <= self.summary_trigger:
+            return
+        if self.failures >= MEMORY_MAX_ATTEMPTS or asyncio.get_running_loop().time() < self.retry_at:
+            # summarizing is failing, keep memory bounded without it
+            self.enforce_hard_limit()
+            return
+
+        # oldest messages until what is left fits in keep_recent
+        count = 0
+        remaining = self.tokens
+        for tokens in self.message_tokens:
+            if remaining <= self.keep_recent:
+                break
+            remaining -= tokens
+            count += 1
+
+        if count > 0:
+            self.summary_task = asyncio.create_task(self.fold(count))
+
+    async def fold(self, count: int):
+        old_messages = list(self.messages)[:count]
+        try:
+            summary = await self.summarize(self.summary, old_messages)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("Error while summarizing conversation", e)
+            summary = None
+
+        self.summary_task = None
+        if summary is None:
+            self.failures += 1
+            self.retry_at = asyncio.get_running_loop().time() + MEMORY_RETRY_DELAY * 2 ** (self.failures - 1)
+            self.enforce_hard_limit()
+            return
+
+        self.failures = 0
+        self.summary = summary.strip()
+        self.summary_tokens = self.counter.count(self.summary)
+        self.drop(count)
+        # turns added while folding may already need the next fold
+        self.maybe_summarize()
+
+    def enforce_hard_limit(self):
+        while self.tokens > self.hard_limit and len(self.messages) > 1:
+            self.drop(1)
+
+    def drop(self, count: int):
+        # new messages are only appended, so the folded ones are still at the front
+        for _ in range(min(count, len(self.messages))):
+            self.messages.popleft()
+            self.tokens -= self.message_tokens.popleft()
+
+    def close(self):
+        if self.summary_task is not None:
+            self.summary_task.cancel()
+            self.summary_task = None
@@ -0,0 +1,254 @@
+from abc import ABC, abstractmethod
+import hashlib
+import json
+import math
+import os
+import re
+import time
+import zlib
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+
+RETRIEVAL_TOP_K = 3
+RETRIEVAL_MIN_SCORE = 0.05
+# per turn lookup budget, the search is skipped if embedding the query already used it up
+RETRIEVAL_BUDGET_MS = 5.0
+# documents are split on blank lines and merged into chunks of about this size
+CHUNK_MAX_CHARS = 600
+HASHING_DIM = 4096
+
+INDEX_VECTORS_FILE = "vectors.npy"
+INDEX_META_FILE = "meta.json"
+INDEX_IDF_FILE = "idf.npy"
+
+
+def write_atomic(path: str, write: Callable[[BinaryIO], None]):
+    # write then rename so another worker never reads or maps a half written file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+class Embedder(ABC):
+    name = "embedder"
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """One L2 normalized float32 row per text."""
+        pass
+
+    def fit(self, texts: List[str]):
+        """Learn corpus statistics before the index is embedded, if the embedder has any."""
+        pass
+
+    def save(self, index_dir: str):
+        pass
+
+    def load(self, index_dir: str):
+        pass
+
+
+class HashingEmbedder(Embedder):
+    """Offline TF-IDF embedder: hashed word and bigram counts, sublinear tf, idf fitted on the index."""
+
+    name = "hashing"
+
+    def __init__(self, dim: int = HASHING_DIM):
+        self.dim = dim
+        self.idf: Optional[np.ndarray] = None
+
+    def tokens(self, text: str) -> List[str]:
+        words = re.findall(r"\w+", text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = self.term_frequencies(texts)
+        if self.idf is not None:
+            vectors *= self.idf
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def fit(self, texts: List[str]):
+        document_frequency = np.count_nonzero(self.term_frequencies(texts), axis=0)
+        self.idf = (np.log((1 + len(texts)) / (1 + document_frequency)) + 1).astype(np.float32)
+        # query words that never occur in the index can't match, they would only dilute the query
+        self.idf[document_frequency == 0] = 0.0
+
+    def save(self, index_dir: str):
+        if self.idf is not None:
+            write_atomic(os.path.join(index_dir, INDEX_IDF_FILE), lambda f: np.save(f, self.idf))
+
+    def load(self, index_dir: str):
+        self.idf = np.load(os.path.join(index_dir, INDEX_IDF_FILE))
+
+    def term_frequencies(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts: Dict[int, float] = {}
+            for token in self.tokens(text):
+                h = zlib.crc32(token.encode("utf-8"))
+                # sign bit keeps collisions from only ever adding up
+                slot = (h % self.dim, 1.0 if h & 0x80000000 else -1.0)
+                counts[slot] = counts.get(slot, 0.0) + 1.0
+            for (slot, sign), count in counts.items():
+                vectors[row, slot] += sign * (1.0 + math.log(count))
+        return vectors
+
+
+def chunk_text(text: str, max_chars: int = CHUNK_MAX_CHARS) -> List[str]:
+    chunks = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) + 1 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current} {paragraph}".strip()
+        # a single long paragraph is cut on sentence ends
+        while len(current) > max_chars:
+            cut = current.rfind(". ", 0, max_chars)
+            cut = cut + 1 if cut > 0 else max_chars
+            chunks.append(current[:cut].strip())
+            current = current[cut:].strip()
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class VectorIndex:
+    """Chunk embeddings in one .npy matrix, loaded memory-mapped, and the chunk texts beside it."""
+
+    def __init__(self, vectors: np.ndarray, sources: List[str], texts: List[str], fingerprint: str = ""):
+        self.vectors = vectors
+        self.sources = sources
+        self.texts = texts
+        self.fingerprint = fingerprint
+
+    @staticmethod
+    def make_fingerprint(documents: Dict[str, str], embedder: Embedder) -> str:
+        payload = json.dumps(
+            [sorted(documents.items()), embedder.name, getattr(embedder, "dim", None), CHUNK_MAX_CHARS]
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def build(cls, documents: Dict[str, str], embedder: Embedder) -> "VectorIndex":
+        sources = []
+        texts = []
+        for source, text in documents.items():
+            for chunk in chunk_text(text):
+                sources.append(source)
+                texts.append(chunk)
+
+        if texts:
+            embedder.fit(texts)
+            vectors = embedder.embed(texts).astype(np.float32)
+        else:
+            vectors = np.zeros((0, getattr(embedder, "dim", 1)), dtype=np.float32)
+        return cls(vectors, sources, texts, cls.make_fingerprint(documents, embedder))
+
+    def save(self, index_dir: str, embedder: Embedder):
+        os.makedirs(index_dir, exist_ok=True)
+        embedder.save(index_dir)
+        write_atomic(os.path.join(index_dir, INDEX_VECTORS_FILE), lambda f: np.save(f, self.vectors))
+        # meta carries the fingerprint, written last so it only ever describes complete files
+        meta = {"fingerprint": self.fingerprint, "sources": self.sources, "texts": self.texts}
+        write_atomic(
+            os.path.join(index_dir, INDEX_META_FILE), lambda f: f.write(json.dumps(meta).encode("utf-8"))
+        )
+
+    @classmethod
+    def load(cls, index_dir: str) -> "VectorIndex":
+        with open(os.path.join(index_dir, INDEX_META_FILE)) as f:
+            meta = json.load(f)
+        vectors = np.load(os.path.join(index_dir, INDEX_VECTORS_FILE), mmap_mode="r")
+        if vectors.shape[0] != len(meta["texts"]):
+            # files of two different builds, another worker is rewriting the index
+            raise ValueError("index vectors don't match its meta")
+        return cls(vectors, meta["sources"], meta["texts"], meta["fingerprint"])
+
+    @classmethod
+    def load_or_build(cls, index_dir: str, documents: Dict[str, str], embedder: Embedder) -> "VectorIndex":
+        """Reuse the index on disk unless the documents or the embedder changed."""
+        fingerprint = cls.make_fingerprint(documents, embedder)
+        try:
+            index = cls.load(index_dir)
+            if index.fingerprint == fingerprint:
+                embedder.load(index_dir)
+                return index
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+        print("Building retrieval index", index_dir)
+        index = cls.build(documents, embedder)
+        index.save(index_dir, embedder)
+        # reload so the vectors are served from the memory-mapped file
+        return cls.load(index_dir)
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[float, int]]:
+        if len(self.texts) == 0:
+            return []
+        scores = self.vectors @ query
+        k = min(k, scores.shape[0])
+        # partial sort, only the top k are ordered
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), int(i)) for i in top]
+
+
+class ContextRetriever:
+    def __init__(
+        self,
+        index: VectorIndex,
+        embedder: Embedder,
+        k: int = RETRIEVAL_TOP_K,
+        min_score: float = RETRIEVAL_MIN_SCORE,
+        budget_ms: float = RETRIEVAL_BUDGET_MS,
+    ):
+        self.index = index
+        self.embedder = embedder
+        self.k = k
+        self.min_score = min_score
+        self.budget_ms = budget_ms
+        self.last_ms = 0.0
+        self.overruns = 0
+
+    def retrieve(self, text: str) -> str:
+        """Top chunks for text formatted for the system message, empty if nothing relevant."""
+        started = time.perf_counter()
+        query = self.embedder.embed([text])[0]
+
+        results = []
+        if (time.perf_counter() - started) * 1000 < self.budget_ms:
+            results = self.index.search(query, self.k)
+
+        self.last_ms = (time.perf_counter() - started) * 1000
+        if self.last_ms > self.budget_ms:
+            self.overruns += 1
+            print(f"Retrieval took {self.last_ms:.1f} ms, budget is {self.budget_ms} ms")
+
+        lines = [
+            f"[{self.index.sources[i]}] {self.index.texts[i]}"
+            for score, i in results
+            if score >= self.min_score
+        ]
+        return "\n".join(lines)
+
+
+def load_documents(paths: Dict[str, Optional[str]]) -> Dict[str, str]:
+    """Reads the named source files that are set and exist, e.g. {"resume": "resume.txt"}."""
+    documents = {}
+    for source, path in paths.items():
+        if not path:
+            continue
+        try:
+            with open(path, encoding="utf-8") as f:
+                documents[source] = f.read()
+        except OSError as e:
+            print("Error while reading retrieval source", source, e)
+    return documents
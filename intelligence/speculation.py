@@ -0,0 +1,88 @@
+import asyncio
+from contextlib import aclosing
+from difflib import SequenceMatcher
+import re
+from typing import AsyncIterator, Dict, List, Optional
+
+
+# final transcript must be this close (word level) to the interim one to reuse its response
+SPECULATION_SIMILARITY = 0.9
+
+
+def normalize_transcript(text: str) -> List[str]:
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+
+class SpeculativeResponse:
+    """LLM response started on a stable interim transcript.
+
+    Phrases are buffered until the final transcript either confirms the
+    speculation (replay) or replaces it (cancel).
+    """
+
+    def __init__(
+        self,
+        text: str,
+        sender_name: str,
+        phrases: AsyncIterator[str],
+        marks: Optional[Dict[str, float]] = None,
+    ):
+        self.text = text
+        self.sender_name = sender_name
+        self.words = normalize_transcript(text)
+        self.phrases: List[str] = []
+        self.done = False
+        # set when the llm request failed, the turn then falls back to a fresh request
+        self.error: Optional[Exception] = None
+        # llm stage timestamps, linked to the turn that replays this response
+        self.marks = marks if marks is not None else {}
+        self.new_phrase = asyncio.Event()
+        self.task = asyncio.create_task(self.collect(phrases))
+
+    async def collect(self, phrases: AsyncIterator[str]):
+        try:
+            async with aclosing(phrases):
+                async for phrase in phrases:
+                    self.phrases.append(phrase)
+                    self.new_phrase.set()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print("Error while generating speculative response", e)
+            self.error = e
+        finally:
+            self.done = True
+            self.new_phrase.set()
+
+    @property
+    def usable(self) -> bool:
+        # a failed or empty finished response has nothing to replay
+        return self.error is None and not (self.done and not self.phrases)
+
+    def matches(self, text: str, sender_name: str) -> bool:
+        if sender_name != self.sender_name:
+            return False
+        words = normalize_transcript(text)
+        if words == self.words:
+            return True
+        return SequenceMatcher(None, self.words, words).ratio() >= SPECULATION_SIMILARITY
+
+    async def replay(self) -> AsyncIterator[str]:
+        """Buffered phrases first, then the rest as the model produces them."""
+        index = 0
+        try:
+            while True:
+                while index < len(self.phrases):
+                    yield self.phrases[index]
+                    index += 1
+                if self.done:
+                    return
+                self.new_phrase.clear()
+                await self.new_phrase.wait()
+        finally:
+            # replay closed early (interrupted), stop the llm stream as well
+            if not self.done:
+                self.cancel()
+
+    def cancel(self):
+        self.task.cancel()
@@ -2,15 +2,14 @@
 VideoSDK realtime AI Agent | Interviewer
 '''
 import os
+import json
 import asyncio
 import signal
 import traceback
 import logging
-from agent.audio_stream_track import CustomAudioStreamTrack
-from tts.elevenlabs_tts import ElevenLabsTTS
-from intelligence.intelligence_client import OpenAIIntelligence
-from stt.deepgram_stt import DeepgramSTT
-from agent.agent import AIInterviewer
+from agent.filler import FILLER_DEADLINE_MS
+from agent.control import ControlServer, CONTROL_HOST
+from agent.supervisor import Supervisor
 from dotenv import load_dotenv
 load_dotenv()
 loop = asyncio.new_event_loop()
@@ -20,7 +19,50 @@ language = os.getenv("LANGUAGE", "en-US")
 stt_api_key = os.getenv("DEEPGRAM_API_KEY")
 tts_api_key = os.getenv("ELEVENLABS_API_KEY")
 llm_api_key = os.getenv("LLM_API_KEY")
-agent: AIInterviewer = None
+tts_cache_dir = os.getenv("TTS_CACHE_DIR")
+# optional, said as soon as the candidate joins, synthesized at startup
+opening_phrase = os.getenv("OPENING_PHRASE")
+# acknowledgements played when the reply is late, "|" separated
+filler_phrases = os.getenv("FILLER_PHRASES", "Mm-hmm.|Let me think.|Okay.").split("|")
+# optional retrieval sources, indexed into RAG_INDEX_DIR once and memory-mapped afterwards
+rag_sources = {
+    "job description": os.getenv("JOB_DESCRIPTION_PATH"),
+    "question bank": os.getenv("QUESTION_BANK_PATH"),
+    "resume": os.getenv("RESUME_PATH"),
+}
+rag_index_dir = os.getenv("RAG_INDEX_DIR", ".rag_index")
+filler_deadline_ms = int(os.getenv("FILLER_DEADLINE_MS", FILLER_DEADLINE_MS))
+# optional, local vad overrides, unset ones keep the EnergyVAD defaults
+vad_options = {
+    name: cast(os.environ[env])
+    for name, env, cast in (
+        ("threshold_db", "VAD_THRESHOLD_DB", float),
+        ("hangover_ms", "VAD_HANGOVER_MS", int),
+        ("preroll_ms", "VAD_PREROLL_MS", int),
+        ("min_speech_ms", "VAD_MIN_SPEECH_MS", int),
+    )
+    if os.getenv(env)
+}
+# optional, json of overrides per peer id or display name, e.g. {"Candidate": {"threshold_db": -50}}
+peer_vad_options = json.loads(os.getenv("VAD_PEER_OPTIONS") or "{}")
+# start the llm request on stable interim transcripts, set to false to only send final ones
+speculative = os.getenv("SPECULATIVE", "true").lower() not in ("0", "false", "no")
+# optional, per-turn latency traces are appended here as json lines
+trace_file = os.getenv("TRACE_FILE")
+# optional, other endpoints for the stt, llm (any openai compatible api) and tts services
+stt_url = os.getenv("DEEPGRAM_URL")
+llm_base_url = os.getenv("LLM_BASE_URL")
+tts_base_url = os.getenv("ELEVENLABS_BASE_URL")
+# what is done with each kind of remote stream: decode, drain (received, not decoded) or decline (closed locally)
+subscriptions = os.getenv("SUBSCRIPTIONS", "audio=decode,video=decline")
+# set to serve the local control api and run any number of rooms in this process
+control_port = os.getenv("CONTROL_PORT")
+# > 0 shards rooms over this many worker processes, one per core
+workers = int(os.getenv("WORKERS", "0"))
+# agent.host is only imported where a host is built, a supervisor never loads the media stack
+host = None
+supervisor: Supervisor = None
+control: ControlServer = None
 stopped: bool = False
 
 class Bcolors:
@@ -31,39 +73,52 @@ class Bcolors:
 
 async def run():
     '''main function'''
-    global interviewer
+    global host, supervisor, control
     try:
         print("Loading Interviewer...")
-        # audio player
-        audio_track = CustomAudioStreamTrack(
-            loop=loop,
-            handle_interruption=True,
-        )
+        options = {
+            "stt_api_key": stt_api_key,
+            "tts_api_key": tts_api_key,
+            "llm_api_key": llm_api_key,
+            "language": language,
+            "model": "gpt-4o",
+            "tts_cache_dir": tts_cache_dir,
+            "rag_sources": rag_sources,
+            "rag_index_dir": rag_index_dir,
+            "opening_phrase": opening_phrase,
+            "filler_phrases": filler_phrases,
+            "filler_deadline_ms": filler_deadline_ms,
+            "vad_options": vad_options,
+            "peer_vad_options": peer_vad_options,
+            "speculative": speculative,
+            "trace_file": trace_file,
+            "stt_url": stt_url,
+            "llm_base_url": llm_base_url,
+            "tts_base_url": tts_base_url,
+            "subscriptions": subscriptions,
+        }
 
-        # tts client
-        tts_client = ElevenLabsTTS(
-            api_key=tts_api_key,
-            output_track=audio_track,
-        )
+        if workers > 0:
+            # rooms are sharded over worker processes, each with its own host
+            supervisor = Supervisor(loop=loop, options=options, workers=workers)
+            await supervisor.start()
+            target = supervisor
+        else:
+            from agent.host import build_host
 
-        # intelligence client
-        intelligence_client = OpenAIIntelligence( 
-            api_key = llm_api_key, 
-            model="gpt-4o", 
-            tts=tts_client
-        )
+            # shared clients and phrase cache, one session per room
+            host = build_host(loop, options)
 
-        # stt client
-        stt_client = DeepgramSTT(
-            loop=loop,
-            api_key=stt_api_key,
-            language=language,
-            intelligence=intelligence_client
-        )
+            # open connections and fill the phrase cache before anyone can speak
+            await host.prewarm()
+            target = host
 
-        interviewer = AIInterviewer(loop=loop, audio_track=audio_track, stt=stt_client, intelligence=intelligence_client)
-       
-        await interviewer.join(meeting_id=room_id, token=auth_token)
+        if control_port:
+            control = ControlServer(target, host=CONTROL_HOST, port=int(control_port))
+            await control.start()
+
+        if room_id:
+            await target.start_session(room_id=room_id, token=auth_token)
 
     except Exception as e:
         traceback.print_exc()
@@ -72,34 +127,49 @@ async def run():
 
 async def destroy():
     '''delete character peer'''
-    global interviewer
+    global host, supervisor, control
     global stopped
+    if stopped:
+        return
+    stopped = True
     print("Destroying Character Bot ...")
-    if interviewer != None and not stopped:
-        stopped = True
-        await interviewer.leave()
-        interviewer = None
+    if control != None:
+        await control.close()
+        control = None
+    if supervisor != None:
+        await supervisor.drain()
+        supervisor = None
+    if host != None:
+        await host.close()
+        host = None
+
+async def shutdown():
+    '''leave every meeting, then stop the loop'''
+    try:
+        await destroy()
+    finally:
+        loop.stop()
 
-def sigterm_handler(signum, frame):
-    '''sigterm handler'''
+def signal_handler(signum):
+    '''sigterm / sigint handler, runs on the loop'''
     print("EXTING with :: ", signum)
-    asyncio.create_task(destroy())
-    loop.stop()
-    loop.close()
+    if not stopped:
+        loop.create_task(shutdown())
     
-try:
-    # Configure the logging module to capture logs from built-in modules and save to a file
-    logging.basicConfig(filename='logfile.log',
-                        filemode='w', level=logging.DEBUG)
+if __name__ == "__main__":
+    try:
+        # Configure the logging module to capture logs from built-in modules and save to a file
+        logging.basicConfig(filename='logfile.log',
+                            filemode='w', level=logging.DEBUG)
 
-    # Register the SIGTERM handler
-    signal.signal(signal.SIGTERM, sigterm_handler)
-    # Register the SIGINT handler
-    signal.signal(signal.SIGINT, sigterm_handler)
+        # drain gracefully on SIGTERM / SIGINT instead of closing the loop under running tasks
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, signal_handler, signum)
 
-    loop.run_until_complete(run())
-    loop.run_forever()
-except KeyboardInterrupt:
-    pass
-finally:
-    loop.run_until_complete(destroy())
+        loop.run_until_complete(run())
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(destroy())
+        loop.close()
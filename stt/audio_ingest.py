@@ -0,0 +1,103 @@
+from typing import Tuple
+from av import AudioFrame, AudioResampler
+
+
+INGEST_SAMPLE_RATE = 16000
+INGEST_CHANNELS = 1
+SAMPLE_WIDTH = 2
+# inbound frames are sent in packets of this duration instead of one message per 10-20 ms frame
+INGEST_PACKET_MS = 100
+
+
+class AudioIngest:
+    """Converts inbound WebRTC frames into the linear16 pcm sent to STT.
+
+    One instance per peer stream, the resampler keeps state between frames.
+    """
+
+    def __init__(
+        self, sample_rate: int = INGEST_SAMPLE_RATE, channels: int = INGEST_CHANNELS
+    ):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.layout = "mono" if channels == 1 else "stereo"
+        self.resampler: AudioResampler = None
+
+    def matches(self, frame: AudioFrame) -> bool:
+        return (
+            frame.format.name == "s16"
+            and frame.sample_rate == self.sample_rate
+            and len(frame.layout.channels) == self.channels
+        )
+
+    def frame_to_bytes(self, frame: AudioFrame) -> bytes:
+        # packed s16 lives in the first plane, which may be padded past the samples
+        size = frame.samples * self.channels * SAMPLE_WIDTH
+        return bytes(memoryview(frame.planes[0])[:size])
+
+    def convert(self, frame: AudioFrame) -> bytes:
+        if self.matches(frame):
+            return self.frame_to_bytes(frame)
+
+        if self.resampler is None:
+            self.resampler = AudioResampler(
+                format="s16", layout=self.layout, rate=self.sample_rate
+            )
+
+        # downmix and resample, the resampler may hold samples back between calls
+        return b"".join(
+            self.frame_to_bytes(resampled) for resampled in self.resampler.resample(frame)
+        )
+
+
+class IngestMetrics:
+    def __init__(self):
+        self.frames = 0
+        self.packets = 0
+        self.bytes = 0
+        self.send_seconds = 0.0
+        self.max_send_seconds = 0.0
+
+    def record(self, frames: int, size: int, send_seconds: float):
+        self.frames += frames
+        self.packets += 1
+        self.bytes += size
+        self.send_seconds += send_seconds
+        self.max_send_seconds = max(self.max_send_seconds, send_seconds)
+
+    def as_dict(self) -> dict:
+        return {
+            "frames": self.frames,
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "frames_per_packet": self.frames / self.packets if self.packets else 0.0,
+            "avg_send_ms": 1000 * self.send_seconds / self.packets if self.packets else 0.0,
+            "max_send_ms": 1000 * self.max_send_seconds,
+        }
+
+
+class PacketAggregator:
+    """Coalesces converted frames into fixed duration packets for the STT websocket."""
+
+    def __init__(
+        self,
+        packet_ms: int = INGEST_PACKET_MS,
+        sample_rate: int = INGEST_SAMPLE_RATE,
+        channels: int = INGEST_CHANNELS,
+    ):
+        self.packet_size = int(sample_rate * packet_ms / 1000) * channels * SAMPLE_WIDTH
+        self.buffer = bytearray()
+        self.frames = 0
+
+    def add(self, pcm: bytes) -> bool:
+        """Buffer pcm, returns True once a full packet is ready to flush."""
+        self.buffer += pcm
+        self.frames += 1
+        return len(self.buffer) >= self.packet_size
+
+    def flush(self) -> Tuple[bytes, int]:
+        """Pending pcm and the number of frames it holds."""
+        packet, frames = bytes(self.buffer), self.frames
+        self.buffer.clear()
+        self.frames = 0
+        return packet, frames
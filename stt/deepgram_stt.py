@@ -1,107 +1,220 @@
-from asyncio.log import logger
+import asyncio
+import time
 import traceback
-from typing import Dict, List
+from typing import Dict, List, Optional
 from deepgram import (
     DeepgramClient,
     DeepgramClientOptions,
     LiveTranscriptionEvents,
     LiveOptions,
-    ListenWebSocketClient,
+    AsyncListenWebSocketClient,
 )
-from asyncio import AbstractEventLoop, Task
-import numpy as np
+from asyncio import AbstractEventLoop
 from datetime import datetime, timezone
 from vsaiortc.mediastreams import MediaStreamError
 from videosdk import Stream
 from stt.stt import STT
+from agent.filler import FillerAudio
+from agent.tracing import TurnTracer
+from stt.audio_ingest import (
+    AudioIngest,
+    SAMPLE_WIDTH,
+    PacketAggregator,
+    INGEST_CHANNELS,
+    INGEST_PACKET_MS,
+    INGEST_SAMPLE_RATE,
+)
+from stt.peer_session import PeerSession
+from stt.vad import EnergyVAD, SPEECH_ENDED, SPEECH_STARTED
 from intelligence.intelligence import Intelligence
 
 
-LEARNING_RATE = 0.1
-LENGTH_THRESHOLD = 5
-SMOOTHING_FACTOR = 3
-BASE_WPM = 150.0
 VAD_THRESHOLD_MS = 25
 UTTERANCE_CUTOFF_MS = 300
+SPECULATION_MIN_WORDS = 3
+
+
+def create_deepgram_client(api_key: str, url: Optional[str] = None) -> DeepgramClient:
+    # url points the client at another deployment, e.g. the local fake in benchmarks/
+    return DeepgramClient(
+        api_key=api_key,
+        config=DeepgramClientOptions(url=url or "", options={"keepalive": True}),
+    )
 
 
 class DeepgramSTT(STT):
 
     def __init__(
-        self, loop: AbstractEventLoop, api_key, language, intelligence: Intelligence
+        self,
+        loop: AbstractEventLoop,
+        api_key,
+        language,
+        intelligence: Intelligence,
+        sample_rate: int = INGEST_SAMPLE_RATE,
+        channels: int = INGEST_CHANNELS,
+        packet_ms: int = INGEST_PACKET_MS,
+        vad_enabled: bool = True,
+        vad_options: Optional[dict] = None,
+        peer_vad_options: Optional[Dict[str, dict]] = None,
+        speculative: bool = False,
+        filler: Optional[FillerAudio] = None,
+        barge_in: bool = True,
+        deepgram_client: Optional[DeepgramClient] = None,
+        tracer: Optional[TurnTracer] = None,
     ) -> None:
         self.loop = loop
 
+        # inbound audio is downmixed and resampled to this before it is sent
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.packet_ms = packet_ms
+
+        # local energy vad, only voiced audio (plus pre-roll and hangover) is sent
+        # deepgram keepalives during gated silence are sent by the sdk (keepalive option)
+        self.vad_enabled = vad_enabled
+        self.vad_options = vad_options or {}
+        # overrides on top of vad_options, keyed by peer id or display name
+        self.peer_vad_options: Dict[str, dict] = dict(peer_vad_options or {})
+
+        # start the llm on stable interim transcripts, confirmed or dropped on the final one
+        self.speculative = speculative
+
+        # armed at each endpoint, plays a short clip if the reply is late
+        self.filler = filler
+
+        # speech from a peer stops the agent's reply
+        self.barge_in_enabled = barge_in
+
+        # each final transcript begins a traced turn
+        self.tracer = tracer
+
         self.vad_threshold_ms: int = VAD_THRESHOLD_MS
         self.utterance_cutoff_ms: int = UTTERANCE_CUTOFF_MS
         self.model = "nova-2"
-        self.speed_coefficient: float = 1.0
-        self.wpm_0 = BASE_WPM * self.speed_coefficient
-        self.wpm = self.wpm_0
-        self.speed_coefficient = self.speed_coefficient
-
-        self.buffer = ""
-        self.words_buffer = []
 
-        self.deepgram_client = DeepgramClient(
-            api_key=api_key,
-            config=DeepgramClientOptions(options={"keepalive": True}),
-        )
+        # usually the host's client, one connection pool for all of its sessions
+        self.deepgram_client = deepgram_client or create_deepgram_client(api_key)
         self.language = language
-        self.deepgram_connections: Dict[str, ListenWebSocketClient] = {}
-        self.audio_tasks: Dict[str, Task] = {}
 
-        self.finalize_called: Dict[str, bool] = {}
+        # per-peer connection, buffers and adaptive wpm state
+        self.sessions: Dict[str, PeerSession] = {}
+
+        # connected session kept ready for the next peer once prewarm is called
+        self.standby_session: Optional[PeerSession] = None
+        self.prewarm_task: Optional[asyncio.Task] = None
+        self.closed = False
 
         # intelligence
         self.intelligence = intelligence
 
-    def start(self, peer_id: str, peer_name: str, stream: Stream):
-
-        def on_deepgram_stt_text_available(connection, result, **kwargs):
-            self.on_deepgram_stt_text_available(
-                peer_id=peer_id, peer_name=peer_name, result=result
-            )
-
-        def on_utterance_end(connection, utterance_end, **kwargs):
-            self.on_utterance_end(peer_id=peer_id, peer_name=peer_name)
+    def start(self, peer_id: str, peer_name: str, stream: Stream, vad_options: Optional[dict] = None):
+        if vad_options is not None:
+            self.set_vad_options(peer_id, **vad_options)
+        if peer_id in self.sessions:
+            self.stop(peer_id)
+
+        session = self.take_standby_session()
+        if session is None:
+            session = self.create_session()
+        session.peer_id = peer_id
+        session.peer_name = peer_name
+        session.vad = self.create_vad(peer_id, peer_name) if self.vad_enabled else None
+
+        self.sessions[peer_id] = session
+        session.audio_task = self.loop.create_task(
+            self.add_peer_stream(stream=stream, session=session)
+        )
 
-        def on_open(connection, open, **kwargs):
-            self.on_open(peer_id=peer_id, peer_name=peer_name)
+    def create_session(self, peer_id: str = None, peer_name: str = None) -> PeerSession:
+        return PeerSession(
+            peer_id=peer_id,
+            peer_name=peer_name,
+            ingest=AudioIngest(sample_rate=self.sample_rate, channels=self.channels),
+            aggregator=PacketAggregator(
+                packet_ms=self.packet_ms,
+                sample_rate=self.sample_rate,
+                channels=self.channels,
+            ),
+        )
 
-        def on_metadata(connection, metadata, **kwargs):
-            self.on_metadata(peer_id=peer_id, peer_name=peer_name, metadata=metadata)
+    async def prewarm(self):
+        # open a websocket ahead of time so the first peer doesn't wait for the handshake
+        if self.closed or self.standby_session is not None:
+            return
+        session = self.create_session()
+        self.standby_session = session
+        try:
+            await self.connect(session)
+        except Exception as e:
+            print("Error while prewarming STT connection", e)
+            if self.standby_session is session:
+                self.standby_session = None
+            return
+
+        if self.closed:
+            # closed while the handshake was running, don't leave the socket open
+            await self.disconnect(session)
+
+    def take_standby_session(self) -> Optional[PeerSession]:
+        session = self.standby_session
+        if session is None or session.connection is None:
+            return None
+        self.standby_session = None
+        # replace it in the background for the next peer
+        self.prewarm_task = self.loop.create_task(self.prewarm())
+        return session
+
+    async def connect(self, session: PeerSession):
+        # peer id and name are read at call time, a standby session gets them when it is taken
+        async def on_deepgram_stt_text_available(connection, result, **kwargs):
+            self.on_deepgram_stt_text_available(session=session, result=result)
+
+        async def on_utterance_end(connection, utterance_end, **kwargs):
+            self.on_utterance_end(peer_id=session.peer_id, peer_name=session.peer_name)
+
+        async def on_open(connection, open, **kwargs):
+            self.on_open(peer_id=session.peer_id, peer_name=session.peer_name)
+
+        async def on_metadata(connection, metadata, **kwargs):
+            self.on_metadata(
+                peer_id=session.peer_id, peer_name=session.peer_name, metadata=metadata
+            )
 
-        def on_speech_started(connection, speech_started, **kwargs):
-            self.on_speech_started(peer_id=peer_id, peer_name=peer_name)
+        async def on_speech_started(connection, speech_started, **kwargs):
+            self.on_speech_started(peer_id=session.peer_id, peer_name=session.peer_name)
 
-        def on_close(connection, close, **kwargs):
-            self.on_close(peer_id=peer_id, peer_name=peer_name)
+        async def on_close(connection, close, **kwargs):
+            if self.standby_session is session:
+                # dropped before a peer took it
+                self.standby_session = None
+            self.on_close(peer_id=session.peer_id, peer_name=session.peer_name)
 
-        def on_error(connection, error, **kwargs):
-            self.on_error(peer_id=peer_id, peer_name=peer_name, error=error)
+        async def on_error(connection, error, **kwargs):
+            self.on_error(peer_id=session.peer_id, peer_name=session.peer_name, error=error)
 
-        def on_unhandled(connection, unhandled, **kwargs):
-            self.on_unhandled(peer_id=peer_id, peer_name=peer_name, unhandled=unhandled)
+        async def on_unhandled(connection, unhandled, **kwargs):
+            self.on_unhandled(
+                peer_id=session.peer_id, peer_name=session.peer_name, unhandled=unhandled
+            )
 
         deepgram_options = LiveOptions(
             model=self.model,
             language=self.language,
             smart_format=True,
             encoding="linear16",
-            channels=2,
-            sample_rate=48000,
+            channels=self.channels,
+            sample_rate=self.sample_rate,
             interim_results=True,
             vad_events=True,
             filler_words=True,
             punctuate=True,
-            endpointing=int(self.vad_threshold_ms * (1 / self.speed_coefficient)),
+            endpointing=int(self.vad_threshold_ms * (1 / session.speed_coefficient)),
             utterance_end_ms=max(
-                int(self.utterance_cutoff_ms * (1 / self.speed_coefficient)), 1000
+                int(self.utterance_cutoff_ms * (1 / session.speed_coefficient)), 1000
             ),
             no_delay=True,
         )
-        deepgram_connection = self.deepgram_client.listen.live.v("1")
+        deepgram_connection = self.deepgram_client.listen.asynclive.v("1")
 
         deepgram_connection.on(
             LiveTranscriptionEvents.Transcript, on_deepgram_stt_text_available
@@ -113,45 +226,133 @@ class DeepgramSTT(STT):
         deepgram_connection.on(LiveTranscriptionEvents.Close, on_close)
         deepgram_connection.on(LiveTranscriptionEvents.Error, on_error)
         deepgram_connection.on(LiveTranscriptionEvents.Unhandled, on_unhandled)
-        deepgram_connection.start(
+        # the sdk reports a failed handshake by returning False, not by raising
+        started = await deepgram_connection.start(
             deepgram_options,
             addons={"no_delay": "true"},
         )
+        if started is False:
+            raise ConnectionError("could not open the deepgram websocket")
 
-        self.deepgram_connections[peer_id] = deepgram_connection
-
-        self.finalize_called[peer_id] = False
-        self.task = self.loop.create_task(
-            self.add_peer_stream(stream=stream, peer_id=peer_id, peer_name=peer_name)
-        )
+        session.connection = deepgram_connection
 
     def stop(self, peer_id):
-        if peer_id in self.deepgram_connections:
-            print("stop peer audio connection", peer_id)
-            self.deepgram_connections[peer_id].finalize()
-            self.deepgram_connections[peer_id].finish()
-            self.finalize_called[peer_id] = True
-            del self.deepgram_connections[peer_id]
+        session = self.sessions.pop(peer_id, None)
+        if session is None:
+            return
+
+        print("stop peer audio connection", peer_id)
+        session.finalize_called = True
+        if session.audio_task is not None and session.audio_task is not asyncio.current_task():
+            session.audio_task.cancel()
+        # the peer left, a turn still waiting on a block completion has nobody to answer
+        if session.turn_task is not None and not session.turn_task.done():
+            session.turn_task.cancel()
+        self.loop.create_task(self.disconnect(session))
+
+    def close(self):
+        # a prewarm still connecting disconnects itself once connect returns,
+        # cancelling it mid-handshake would lose the connection object instead
+        self.closed = True
+        for peer_id in list(self.sessions):
+            self.stop(peer_id)
+        standby = self.standby_session
+        self.standby_session = None
+        if standby is not None:
+            self.loop.create_task(self.disconnect(standby))
+
+    async def disconnect(self, session: PeerSession):
+        if session.connection is None:
+            return
+        try:
+            # send whatever is still buffered before finalizing
+            await self.flush_packet(session)
+            await session.connection.finalize()
+            await session.connection.finish()
+        except Exception as e:
+            print("Error while closing STT connection", e)
+
+    def set_vad_options(self, peer_id: str, **options):
+        """Override threshold_db, hangover_ms, preroll_ms or min_speech_ms for one peer, applied on its next start."""
+        self.peer_vad_options[peer_id] = options
+
+    def create_vad(self, peer_id: str, peer_name: Optional[str] = None) -> EnergyVAD:
+        # host-wide options, then the peer's display name, then its id
+        options = {
+            **self.vad_options,
+            **self.peer_vad_options.get(peer_name, {}),
+            **self.peer_vad_options.get(peer_id, {}),
+        }
+        return EnergyVAD(sample_rate=self.sample_rate, channels=self.channels, **options)
+
+    def get_ingest_metrics(self) -> Dict[str, dict]:
+        """Packets sent to deepgram so far, per peer."""
+        return {peer_id: session.metrics.as_dict() for peer_id, session in self.sessions.items()}
+
+    async def send_audio(self, session: PeerSession, pcm: bytes):
+        if session.aggregator.add(pcm):
+            await self.flush_packet(session)
+
+    async def flush_packet(self, session: PeerSession):
+        if session.connection is None or session.aggregator.frames == 0:
+            return
+
+        packet, frames = session.aggregator.flush()
+        started_at = time.perf_counter()
+        await session.connection.send(packet)
+        session.metrics.record(
+            frames=frames, size=len(packet), send_seconds=time.perf_counter() - started_at
+        )
+        session.record_sent(
+            seconds=len(packet) / (self.sample_rate * self.channels * SAMPLE_WIDTH),
+            sent_at=time.monotonic(),
+        )
 
     def get_usage(self):
         current_usage = self.usage
         self.usage = 0
         return current_usage
 
-    async def add_peer_stream(self, stream: Stream, peer_id: str, peer_name: str):
+    async def add_peer_stream(self, stream: Stream, session: PeerSession):
         try:
             track = stream.track
 
-            while not self.finalize_called[peer_id]:
+            if session.connection is None:
+                await self.connect(session)
+
+            while not session.finalize_called:
                 frame = await track.recv()
-                audio_data = frame.to_ndarray()
-                pcm_frame = audio_data.flatten().astype(np.int16).tobytes()
-                self.deepgram_connections[peer_id].send(pcm_frame)
+                pcm_frame = session.ingest.convert(frame)
+                if not pcm_frame:
+                    continue
+
+                if session.vad is None:
+                    await self.send_audio(session, pcm_frame)
+                    continue
+
+                voiced_frames, event = session.vad.process(pcm_frame)
+                for voiced_frame in voiced_frames:
+                    await self.send_audio(session, voiced_frame)
+
+                if event == SPEECH_STARTED:
+                    await self.flush_packet(session)
+                    self.on_local_speech_started(
+                        peer_id=session.peer_id, peer_name=session.peer_name
+                    )
+                elif event == SPEECH_ENDED:
+                    # no more audio until the next onset, ask deepgram for the final transcript now
+                    await self.flush_packet(session)
+                    await session.connection.finalize()
+        except asyncio.CancelledError:
+            pass
         except Exception as e:
             traceback.print_exc()
             print("Error while sending audio to STT Server", e)
+        finally:
+            if self.sessions.get(session.peer_id) is session:
+                self.stop(session.peer_id)
 
-    def on_deepgram_stt_text_available(self, peer_id, peer_name, result):
+    def on_deepgram_stt_text_available(self, session: PeerSession, result):
         try:
             top_choice = result.channel.alternatives[0]
 
@@ -159,6 +360,10 @@ class DeepgramSTT(STT):
                 return
 
             # Check for transcript, confidentce and
+            if session.barge_in_pending and top_choice.transcript:
+                # the onset was speech after all, drop the reply it held back
+                self.barge_in(session.peer_id, confirmed=True)
+
             if (
                 top_choice.transcript
                 and top_choice.confidence > 0.0
@@ -168,38 +373,37 @@ class DeepgramSTT(STT):
                 words = top_choice.words
                 if words:
                     # Add words to buffer
-                    self.words_buffer.extend(words)
+                    session.words_buffer.extend(words)
 
-                self.buffer = f"{self.buffer} {top_choice.transcript}"
-                print(f"Buffer {self.buffer}")
+                session.buffer = f"{session.buffer} {top_choice.transcript}"
+                print(f"Buffer {session.buffer}")
 
-            if (self.buffer and self.is_endpoint(result)) or self.finalize_called[
-                peer_id
-            ]:
+            if (session.buffer and self.is_endpoint(result)) or session.finalize_called:
 
-                duration_seconds = self.calculate_duration(self.words_buffer)
+                duration_seconds = self.calculate_duration(session.words_buffer)
                 # print("Duration seconds", duration_seconds)
 
                 if duration_seconds is not None:
                     wpm = (
-                        60 * len(self.buffer.split()) / duration_seconds
+                        60 * len(session.buffer.split()) / duration_seconds
                         if duration_seconds
                         else None
                     )
                     print("WPM", wpm)
                     if wpm is not None:
-                        self.update_speed_coefficient(wpm=wpm, message=self.buffer)
+                        session.update_speed_coefficient(wpm=wpm, message=session.buffer)
 
-                self.produce_text(self.buffer, peer_name=peer_name, is_final=True)
+                self.produce_text(session.buffer, session=session, is_final=True)
 
             if top_choice.transcript and top_choice.confidence > 0.0:
                 if not result.is_final:
-                    interim_message = f"{self.buffer} {top_choice.transcript}"
+                    interim_message = f"{session.buffer} {top_choice.transcript}"
                 else:
-                    interim_message = self.buffer
+                    interim_message = session.buffer
 
-                # if interim_message:
-                #     self.produce_text(interim_message, peer_name=peer_name,is_final=False)
+                interim_message = interim_message.strip()
+                if interim_message:
+                    self.produce_text(interim_message, session=session, is_final=False)
 
         except Exception as e:
             print("Error while transcript processing", e)
@@ -212,7 +416,44 @@ class DeepgramSTT(STT):
 
     def on_speech_started(self, peer_id, peer_name):
         # print(f"[{peer_name}] Speech Started")
-        pass
+        # don't hold the start of an utterance back for a full packet
+        if peer_id in self.sessions:
+            self.loop.create_task(self.flush_packet(self.sessions[peer_id]))
+        self.barge_in(peer_id)
+
+    def on_local_speech_started(self, peer_id, peer_name):
+        # print(f"[{peer_name}] Local Speech Started")
+        # local vad fires before deepgram does, stop talking right away
+        self.barge_in(peer_id)
+
+    def barge_in(self, peer_id, confirmed: bool = False):
+        """Stop the reply when the candidate starts talking.
+
+        A reply already playing is cut on the vad onset. A reply that hasn't
+        played anything yet is only dropped once a transcript confirms the new
+        speech, a cough or a click after the question must not lose the answer.
+        A filler clip stops on the onset either way.
+        """
+        if not self.barge_in_enabled:
+            return
+        if self.filler is not None:
+            self.filler.stop()
+
+        session = self.sessions.get(peer_id)
+        if not confirmed and not self.intelligence.speaking():
+            if session is not None:
+                session.barge_in_pending = True
+            return
+        if session is not None:
+            session.barge_in_pending = False
+
+        # a turn still waiting on a block completion is dropped too
+        if session is not None and session.turn_task is not None and not session.turn_task.done():
+            session.turn_task.cancel()
+        if self.tracer is not None:
+            self.tracer.finish("interrupted")
+
+        self.intelligence.interrupt()
 
     def on_utterance_end(self, peer_id, peer_name):
         print(f"Utterance End")
@@ -231,8 +472,10 @@ class DeepgramSTT(STT):
         return datetime.now(tz=timezone.utc)
 
     def is_endpoint(self, deepgram_response):
+        # results flushed by finalize (sent when the local vad closes) end the utterance too
         is_endpoint = (deepgram_response.channel.alternatives[0].transcript) and (
             deepgram_response.speech_final
+            or getattr(deepgram_response, "from_finalize", False)
         )
         return is_endpoint
 
@@ -241,29 +484,47 @@ class DeepgramSTT(STT):
             return 0.0
         return words[-1]["end"] - words[0]["start"]
 
-    def produce_text(self, text: str, peer_name: str, is_final: bool = False):
+    def produce_text(self, text: str, session: PeerSession, is_final: bool = False):
         try:
             if is_final and text:
                 # peer final message after speech
-                print(f"[{peer_name}]:", text)
-                self.intelligence.generate(text=text, sender_name=peer_name)
-                self.buffer = ""
-                self.words_buffer = []
-
-            if text:
-                # print(f"[{peer_name}]:", text)
-                pass
+                print(f"[{session.peer_name}]:", text)
+                if self.tracer is not None:
+                    self.tracer.begin_turn(
+                        peer_name=session.peer_name, last_word_at=self.last_word_time(session)
+                    )
+                # the turn runs as its own task so transcripts keep flowing meanwhile
+                session.turn_task = self.loop.create_task(
+                    self.run_turn(text=text, peer_name=session.peer_name)
+                )
+                session.reset_buffer()
+
+            if not is_final and text and self.speculative:
+                # same interim twice in a row is treated as stable
+                if (
+                    text == session.last_interim
+                    and len(text.split()) >= SPECULATION_MIN_WORDS
+                ):
+                    self.intelligence.speculate(text=text, sender_name=session.peer_name)
+                session.last_interim = text
         except Exception as e:
             print("Error while producing text", e)
 
-    def update_speed_coefficient(self, wpm: int, message: str):
-        if wpm is not None:
-            length = len(message.strip().split())
-            p_t = min(
-                1,
-                LEARNING_RATE
-                * ((length + SMOOTHING_FACTOR) / (LENGTH_THRESHOLD + SMOOTHING_FACTOR)),
-            )
-            self.wpm = self.wpm * (1 - p_t) + wpm * p_t
-            self.speed_coefficient = self.wpm / BASE_WPM
-            logger.info(f"Set speed coefficient to {self.speed_coefficient}")
+    def last_word_time(self, session: PeerSession) -> Optional[float]:
+        if not session.words_buffer:
+            return None
+        try:
+            return session.local_time(session.words_buffer[-1]["end"])
+        except (KeyError, TypeError):
+            return None
+
+    async def run_turn(self, text: str, peer_name: str):
+        if self.filler is not None:
+            self.filler.arm()
+        try:
+            await self.intelligence.generate(text=text, sender_name=peer_name)
+        except Exception as e:
+            traceback.print_exc()
+            print("Error while generating response", e)
+            if self.tracer is not None:
+                self.tracer.finish("error")
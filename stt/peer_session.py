@@ -0,0 +1,104 @@
+from asyncio import Task
+from asyncio.log import logger
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+from deepgram import AsyncListenWebSocketClient
+from stt.audio_ingest import AudioIngest, IngestMetrics, PacketAggregator
+from stt.vad import EnergyVAD
+
+
+LEARNING_RATE = 0.1
+LENGTH_THRESHOLD = 5
+SMOOTHING_FACTOR = 3
+BASE_WPM = 150.0
+# sent packets remembered to map word timings back to local time
+SENT_PACKET_HISTORY = 300
+
+
+class PeerSession:
+    """Everything DeepgramSTT keeps for one peer: connection, ingest, transcript and WPM state."""
+
+    __slots__ = (
+        "peer_id",
+        "peer_name",
+        "connection",
+        "audio_task",
+        "turn_task",
+        "barge_in_pending",
+        "ingest",
+        "vad",
+        "aggregator",
+        "metrics",
+        "sent_seconds",
+        "sent_packets",
+        "buffer",
+        "words_buffer",
+        "last_interim",
+        "wpm",
+        "speed_coefficient",
+        "finalize_called",
+    )
+
+    def __init__(
+        self,
+        peer_id: str,
+        peer_name: str,
+        ingest: AudioIngest,
+        aggregator: PacketAggregator,
+        vad: Optional[EnergyVAD] = None,
+    ):
+        self.peer_id = peer_id
+        self.peer_name = peer_name
+        self.connection: Optional[AsyncListenWebSocketClient] = None
+        self.audio_task: Optional[Task] = None
+        self.turn_task: Optional[Task] = None
+        # vad onset while the reply wasn't playing yet, barge-in waits for a transcript
+        self.barge_in_pending = False
+
+        self.ingest = ingest
+        self.vad = vad
+        self.aggregator = aggregator
+        self.metrics = IngestMetrics()
+
+        # audio seconds sent on the connection, deepgram word timings count from its start
+        self.sent_seconds = 0.0
+        # (audio offset at the end of the packet, monotonic send time)
+        self.sent_packets: Deque[Tuple[float, float]] = deque(maxlen=SENT_PACKET_HISTORY)
+
+        self.buffer = ""
+        self.words_buffer: List[dict] = []
+        self.last_interim = ""
+
+        self.speed_coefficient: float = 1.0
+        self.wpm = BASE_WPM * self.speed_coefficient
+
+        self.finalize_called = False
+
+    def reset_buffer(self):
+        self.buffer = ""
+        self.words_buffer = []
+        self.last_interim = ""
+
+    def record_sent(self, seconds: float, sent_at: float):
+        self.sent_seconds += seconds
+        self.sent_packets.append((self.sent_seconds, sent_at))
+
+    def local_time(self, offset: float) -> Optional[float]:
+        """Monotonic time the audio at offset (seconds into the connection) was sent, None if too old."""
+        for end, sent_at in self.sent_packets:
+            if end >= offset:
+                # audio is captured in real time, so earlier audio in the packet is that much older
+                return sent_at - (end - offset)
+        return None
+
+    def update_speed_coefficient(self, wpm: int, message: str):
+        if wpm is not None:
+            length = len(message.strip().split())
+            p_t = min(
+                1,
+                LEARNING_RATE
+                * ((length + SMOOTHING_FACTOR) / (LENGTH_THRESHOLD + SMOOTHING_FACTOR)),
+            )
+            self.wpm = self.wpm * (1 - p_t) + wpm * p_t
+            self.speed_coefficient = self.wpm / BASE_WPM
+            logger.info(f"[{self.peer_name}] Set speed coefficient to {self.speed_coefficient}")
@@ -17,3 +17,10 @@ class STT(ABC):
         """Stop the speech-to-text listening process."""
         pass
 
+    async def prewarm(self):
+        """Open connections ahead of the first peer."""
+        pass
+
+    def close(self):
+        """Stop every peer and release connections."""
+        pass
@@ -0,0 +1,102 @@
+from collections import deque
+import math
+from typing import List, Optional, Tuple
+import numpy as np
+from stt.audio_ingest import INGEST_CHANNELS, INGEST_SAMPLE_RATE, SAMPLE_WIDTH
+
+
+VAD_THRESHOLD_DB = -45.0
+VAD_HANGOVER_MS = 600
+VAD_PREROLL_MS = 300
+# voiced audio needed in a row before speech starts, a click or a breath is shorter
+VAD_MIN_SPEECH_MS = 80
+
+SPEECH_STARTED = "speech_started"
+SPEECH_ENDED = "speech_ended"
+
+
+class EnergyVAD:
+    """RMS energy gate with pre-roll and hangover.
+
+    Frames below threshold_db are held back, the last preroll_ms of them are
+    released when speech starts so the STT still hears the onset, and the
+    gate stays open for hangover_ms after the last voiced frame. Speech only
+    starts after min_speech_ms of consecutive voiced frames.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = INGEST_SAMPLE_RATE,
+        channels: int = INGEST_CHANNELS,
+        threshold_db: float = VAD_THRESHOLD_DB,
+        hangover_ms: int = VAD_HANGOVER_MS,
+        preroll_ms: int = VAD_PREROLL_MS,
+        min_speech_ms: int = VAD_MIN_SPEECH_MS,
+    ):
+        self.bytes_per_ms = sample_rate * channels * SAMPLE_WIDTH / 1000
+        self.threshold_db = threshold_db
+        self.hangover_ms = hangover_ms
+        self.preroll_bytes = int(preroll_ms * self.bytes_per_ms)
+        self.min_speech_ms = min_speech_ms
+
+        self.preroll = deque()
+        self.preroll_size = 0
+        self.voiced = False
+        self.silence_ms = 0.0
+        # voiced audio in a row while the gate is still closed
+        self.onset_ms = 0.0
+        self.onset_bytes = 0
+
+    def energy_db(self, pcm: bytes) -> float:
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+        if samples.size == 0:
+            return -math.inf
+        rms = math.sqrt(float(np.dot(samples, samples)) / samples.size) / 32768.0
+        return 20 * math.log10(rms) if rms > 0 else -math.inf
+
+    def process(self, pcm: bytes) -> Tuple[List[bytes], Optional[str]]:
+        """Returns the pcm to forward for this frame and a speech start/end event, if any."""
+        duration_ms = len(pcm) / self.bytes_per_ms
+        is_voiced = self.energy_db(pcm) >= self.threshold_db
+
+        if self.voiced:
+            if is_voiced:
+                self.silence_ms = 0.0
+                return [pcm], None
+
+            self.silence_ms += duration_ms
+            if self.silence_ms < self.hangover_ms:
+                return [pcm], None
+
+            self.voiced = False
+            self.add_preroll(pcm)
+            return [], SPEECH_ENDED
+
+        if not is_voiced:
+            self.onset_ms = 0.0
+            self.onset_bytes = 0
+            self.add_preroll(pcm)
+            return [], None
+
+        self.onset_ms += duration_ms
+        self.onset_bytes += len(pcm)
+        self.add_preroll(pcm)
+        if self.onset_ms < self.min_speech_ms:
+            return [], None
+
+        # speech onset, release the buffered lead-in and the onset frames
+        self.voiced = True
+        self.silence_ms = 0.0
+        self.onset_ms = 0.0
+        self.onset_bytes = 0
+        forward = list(self.preroll)
+        self.preroll.clear()
+        self.preroll_size = 0
+        return forward, SPEECH_STARTED
+
+    def add_preroll(self, pcm: bytes):
+        self.preroll.append(pcm)
+        self.preroll_size += len(pcm)
+        # the onset frames are kept on top of the lead-in
+        while self.preroll_size > self.preroll_bytes + self.onset_bytes and len(self.preroll) > 1:
+            self.preroll_size -= len(self.preroll.popleft())
@@ -1,26 +1,171 @@
-from elevenlabs import ElevenLabs, VoiceSettings
+from contextlib import aclosing
+from typing import AsyncIterator, List, Optional, Union
+import httpx
+from elevenlabs import AsyncElevenLabs, VoiceSettings
+from elevenlabs.client import DEFAULT_VOICE
 from tts.tts import TTS
+from tts.phrase_cache import PhraseCache
+from agent.http_pool import pooled_limits
+from agent.tracing import TurnTracer
+from agent.tts_job import TTSJob
 from videosdk.stream import MediaStreamTrack
 
 
+VOICE_SETTINGS = {
+    "stability": 0.71,
+    "similarity_boost": 0.5,
+    "style": 0.0,
+    "use_speaker_boost": True,
+}
+HTTP_TIMEOUT = 240
+
+
+def create_elevenlabs_client(api_key: str, base_url: Optional[str] = None) -> AsyncElevenLabs:
+    return AsyncElevenLabs(
+        api_key=api_key,
+        base_url=base_url,
+        httpx_client=httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            follow_redirects=True,
+            limits=pooled_limits(),
+        ),
+    )
+
+
 class ElevenLabsTTS(TTS):
-    def __init__(self, api_key: str, output_track: MediaStreamTrack):
-      self.elevenlabs_client = ElevenLabs(api_key=api_key)
+    def __init__(
+        self,
+        api_key: str,
+        output_track: MediaStreamTrack,
+        voice: Optional[str] = None,
+        cache: Optional[PhraseCache] = None,
+        elevenlabs_client: Optional[AsyncElevenLabs] = None,
+        tracer: Optional[TurnTracer] = None,
+    ):
+      # usually the host's client, see agent.http_pool
+      self.elevenlabs_client = elevenlabs_client or create_elevenlabs_client(api_key)
       self.model = "eleven_multilingual_v2"
+      self.voice = voice or DEFAULT_VOICE.voice_id
+      self.output_format = "pcm_24000"
+      self.voice_settings = VOICE_SETTINGS
       self.output_track = output_track
+      self.cache = cache
+      self.reply_phrases: List[list] = []
+      self.tracer = tracer
+
+    async def prewarm(self):
+        # a cheap request opens the pooled connection and completes the tls handshake
+        try:
+            await self.elevenlabs_client.models.get_all()
+        except Exception as e:
+            print("Error while prewarming TTS connection", e)
+
+    async def render(self, text: str) -> bytes:
+        """Whole pcm of a short phrase, e.g. a filler clip."""
+        pcm = bytearray()
+        async for chunk in self.synthesize(text):
+            pcm += chunk
+        return bytes(pcm)
+
+    def cache_key(self, text: str) -> str:
+        return PhraseCache.make_key(
+            text=text,
+            voice=self.voice,
+            model=self.model,
+            voice_settings=self.voice_settings,
+            output_format=self.output_format,
+        )
+
+    async def synthesize(self, text: str) -> AsyncIterator[bytes]:
+        key = None
+        if self.cache is not None:
+            key = self.cache_key(text)
+            cached = self.cache.get(key)
+            if cached is not None:
+                for chunk in self.cache.chunks(cached):
+                    yield chunk
+                return
 
-    def generate(self, text):
-        """Start the text-to-speech listening process."""
-        tts_bytes = self.elevenlabs_client.generate(
+        tts_bytes = await self.elevenlabs_client.generate(
             text=text,
+            voice=self.voice,
             stream=True,
-            output_format="pcm_24000",
+            output_format=self.output_format,
             model=self.model,
 
-            voice_settings=VoiceSettings(
-                stability=0.71, similarity_boost=0.5, style=0.0, use_speaker_boost=True
-            )
+            voice_settings=VoiceSettings(**self.voice_settings)
         )
-        self.output_track.add_new_bytes(
+        pcm = bytearray()
+        # closing the generator closes the http response, an interrupted phrase stops downloading
+        async with aclosing(tts_bytes):
+            async for chunk in tts_bytes:
+                if key is not None:
+                    pcm += chunk
+                yield chunk
+
+        # only phrases that were streamed completely end up in the cache
+        if key is not None:
+            self.cache.put(key, bytes(pcm))
+
+    async def synthesize_phrases(
+        self, phrases: AsyncIterator[str], reply_phrases: Optional[List[list]] = None
+    ) -> AsyncIterator[bytes]:
+        # [start byte, end byte, phrase] of each phrase is appended to reply_phrases
+        offset = 0
+        async with aclosing(phrases):
+            # each phrase is requested only when the previous one has been consumed
+            async for phrase in phrases:
+                entry = [offset, offset, phrase]
+                if reply_phrases is not None:
+                    reply_phrases.append(entry)
+                async with aclosing(self.synthesize(phrase)) as chunks:
+                    async for chunk in chunks:
+                        if offset == 0 and self.tracer is not None:
+                            self.tracer.mark("tts_first_byte")
+                        offset += len(chunk)
+                        entry[1] = offset
+                        yield chunk
+
+    async def generate(self, text: Union[str, AsyncIterator[str]]) -> TTSJob:
+        """Start the text-to-speech listening process, returns the queued playback job."""
+        if isinstance(text, str):
+            text = single_phrase(text)
+
+        # byte ranges of the reply, used to work out what was heard on interrupt
+        self.reply_phrases = []
+        tts_bytes = self.synthesize_phrases(text, self.reply_phrases)
+
+        job = self.output_track.add_new_bytes(
             bytes=tts_bytes
-        )
\ No newline at end of file
+        )
+        print(f"TTS job {job.id} queued")
+        return job
+
+    def speaking(self) -> bool:
+        return self.output_track.speaking_reply()
+
+    def interrupt(self) -> Optional[str]:
+        played = self.output_track.interrupt()
+        if played is None:
+            return None
+        return self.heard_text(played)
+
+    def heard_text(self, played: int) -> str:
+        heard = []
+        for start, end, phrase in self.reply_phrases:
+            if played <= start:
+                break
+            if played >= end:
+                heard.append(phrase)
+                continue
+            # cut inside this phrase, assume words are spread evenly over its audio
+            words = phrase.split()
+            count = int(len(words) * (played - start) / (end - start))
+            if count > 0:
+                heard.append(" ".join(words[:count]) + "...")
+            break
+        return " ".join(heard)
+
+
+async def single_phrase(text: str) -> AsyncIterator[str]:
+    yield text
@@ -0,0 +1,169 @@
+from collections import OrderedDict
+import hashlib
+import json
+import mmap
+import os
+from typing import Iterator, List, Optional, Tuple, Union
+
+
+PHRASE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# cache_dir budget, the least recently used files are deleted down to LOW_WATERMARK of it
+PHRASE_CACHE_MAX_DISK_BYTES = 1024 * 1024 * 1024
+PHRASE_CACHE_DISK_LOW_WATERMARK = 0.9
+# cached pcm is handed to the audio track in chunks of this size (100 ms of pcm_24000)
+PHRASE_CACHE_CHUNK_SIZE = 4800
+
+
+class PhraseCache:
+    """Content-addressed pcm cache for synthesized phrases.
+
+    Recently used phrases are kept in memory up to max_bytes (LRU), and when
+    cache_dir is set every phrase is also written there and memory-mapped back
+    on a miss, so the cache survives restarts. The directory is kept under
+    max_disk_bytes by deleting the files used least recently (by mtime, which
+    a hit refreshes), it may be shared by several processes.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = PHRASE_CACHE_MAX_BYTES,
+        cache_dir: Optional[str] = None,
+        max_disk_bytes: int = PHRASE_CACHE_MAX_DISK_BYTES,
+    ):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.entries: "OrderedDict[str, Union[bytes, mmap.mmap]]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # estimate between scans, other processes write to the directory too
+        self.disk_size = 0
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.disk_size = sum(size for _, size, _ in self.scan())
+
+    @staticmethod
+    def make_key(
+        text: str, voice: str, model: str, voice_settings: dict, output_format: str
+    ) -> str:
+        payload = json.dumps(
+            [text, voice, model, voice_settings, output_format], sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pcm")
+
+    def get(self, key: str) -> Optional[memoryview]:
+        pcm = self.entries.get(key)
+        if pcm is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.touch(key)
+            return memoryview(pcm)
+
+        pcm = self.load(key)
+        if pcm is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.remember(key, pcm)
+        return memoryview(pcm)
+
+    def load(self, key: str) -> Optional[mmap.mmap]:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self.path(key), "rb") as f:
+                pcm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.touch(key)
+            return pcm
+        except (FileNotFoundError, ValueError):
+            # missing or empty file
+            return None
+        except OSError as e:
+            print("Error while reading phrase cache", e)
+            return None
+
+    def touch(self, key: str):
+        # recently used files are evicted last
+        if not self.cache_dir:
+            return
+        try:
+            os.utime(self.path(key))
+        except OSError:
+            pass
+
+    def put(self, key: str, pcm: bytes):
+        if not pcm:
+            return
+        self.remember(key, pcm)
+        if not self.cache_dir:
+            return
+        try:
+            # write then rename so a reader never maps a half written file
+            tmp_path = f"{self.path(key)}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(pcm)
+            os.replace(tmp_path, self.path(key))
+            self.disk_size += len(pcm)
+            if self.disk_size > self.max_disk_bytes:
+                self.evict_files()
+        except OSError as e:
+            print("Error while writing phrase cache", e)
+
+    def scan(self) -> List[Tuple[str, int, float]]:
+        """(path, size, mtime) of every cached file."""
+        files = []
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".pcm"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # evicted by another process meanwhile
+                    continue
+                files.append((entry.path, stat.st_size, stat.st_mtime))
+        return files
+
+    def evict_files(self):
+        files = sorted(self.scan(), key=lambda file: file[2])
+        self.disk_size = sum(size for _, size, _ in files)
+        target = self.max_disk_bytes * PHRASE_CACHE_DISK_LOW_WATERMARK
+        for path, size, _ in files:
+            if self.disk_size <= target:
+                break
+            try:
+                # a phrase still mapped keeps playing, unlinking only drops the name
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.disk_size -= size
+
+    def remember(self, key: str, pcm: Union[bytes, mmap.mmap]):
+        if len(pcm) > self.max_bytes:
+            return
+        if key in self.entries:
+            self.release(self.entries.pop(key))
+        self.entries[key] = pcm
+        self.size += len(pcm)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.release(evicted)
+
+    def release(self, pcm: Union[bytes, mmap.mmap]):
+        self.size -= len(pcm)
+        if isinstance(pcm, mmap.mmap):
+            try:
+                pcm.close()
+            except BufferError:
+                # still being played, the mapping goes with the last view of it
+                pass
+
+    def chunks(self, pcm: memoryview) -> Iterator[memoryview]:
+        for start in range(0, len(pcm), PHRASE_CACHE_CHUNK_SIZE):
+            yield pcm[start : start + PHRASE_CACHE_CHUNK_SIZE]
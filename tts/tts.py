@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Iterator, Union
+from typing import AsyncIterator, Optional, Union
 
 class TTS(ABC):
     @abstractmethod
@@ -8,8 +8,18 @@ class TTS(ABC):
         pass
 
     @abstractmethod
-    def generate(self, text: Union[str, Iterator[str]]):
+    async def generate(self, text: Union[str, AsyncIterator[str]]):
         """Start the text-to-speech listening process."""
         pass
 
+    async def prewarm(self):
+        """Open and pool connections."""
+        pass
+
+    def speaking(self) -> bool:
+        """Whether reply audio (not a filler) is being played."""
+        return False
 
+    def interrupt(self) -> Optional[str]:
+        """Stop playback, returns the part of the reply that was heard, None if nothing was playing."""
+        return None